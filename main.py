@@ -1,37 +1,482 @@
 """Medrocket Junior Python test task"""
 
+import argparse
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from itertools import islice
+from typing import TYPE_CHECKING, Deque, Iterable, List, Optional, Tuple
+
+from medrocket_test_task.cache import CachingTransport, HTTPCache
+from medrocket_test_task.delta import UserFingerprints
 from medrocket_test_task.deserializers import TodoDeserializer, UserDeserializer
-from medrocket_test_task.logging import Logger
-from medrocket_test_task.writers import FileSystemWriter
-from medrocket_test_task.builders import DefaultUserBuilder
-from medrocket_test_task.providers import APITodoProvider, APIUserProvider
+from medrocket_test_task.index import ReportIndex, ReportIndexGroup
+from medrocket_test_task.logging import Logger, Metrics
+from medrocket_test_task.paths import ReportLayout
+from medrocket_test_task.writers import FileSystemWriter, ReportManifest, SyncBatch, \
+    WriteResult
+from medrocket_test_task.builders import DefaultUserBuilder, UserBuilder
+from medrocket_test_task.model import User
+from medrocket_test_task.ndjson import TODOS_FILE, USERS_FILE, NDJSONTodoProvider, \
+    NDJSONUserProvider
+from medrocket_test_task.providers import APIFanOutUserProvider, APITodoProvider, \
+    APIUserProvider, APIUserTodoProvider, SnapshotUserProvider
+from medrocket_test_task.sharding import Shard
+from medrocket_test_task.snapshots import BinarySnapshot
+from medrocket_test_task.transport import RequestsTransport, UrllibTransport
+
+if TYPE_CHECKING:
+    from medrocket_test_task.archive import ReportArchiver
+    from medrocket_test_task.bulk import ReportContainer
+
+
+def build_document(builder_class: type, user: User, date: datetime = None) -> str:
+    """Builds user document, runs in worker processes"""
+    builder: UserBuilder = builder_class(user, date)
+    return builder.build()
 
 
 class AppController:
     """Connects all app dependencies"""
+    PENDING_PER_WORKER: int = 4
+    FETCH_BATCH: int = 64
+    # Container classes are imported only by the runs writing into them
+    CONTAINERS = {'zip': ('ZipContainer', 'tasks.zip'),
+                  'sqlite': ('SQLiteContainer', 'tasks.sqlite3')}
+    TRANSPORTS = {'requests': RequestsTransport, 'urllib': UrllibTransport}
 
-    def __init__(self) -> None:
-        self.provider = APIUserProvider(
-            UserDeserializer(),
-            APITodoProvider(
-                TodoDeserializer())
-        )
+    def __init__(self, fan_out: int = 0, cache_dir: str = None,
+                 workers: int = 1, build_processes: bool = False,
+                 columnar: bool = False, stream_reports: bool = False,
+                 fsync: bool = False, fsync_batch: int = 0,
+                 archiver: 'ReportArchiver' = None, layout_levels: int = 0,
+                 output: str = 'files', output_path: str = None,
+                 pipeline: bool = False, delta: bool = False,
+                 shard: Shard = None, profile_dir: str = None,
+                 transport: str = 'requests', snapshot_dir: str = None,
+                 binary_snapshot: str = None, binary_snapshot_max_age: float = None) -> None:
+        if delta and output != 'files':
+            raise ValueError('Delta runs write only changed users, so they need file output')
+        self.workers = workers
+        self.profile_dir = profile_dir
+        self.pipeline = pipeline
+        self.build_processes = build_processes
+        self.stream_reports = stream_reports
+        if transport == 'requests':
+            self.transport = RequestsTransport(pool_size=max(fan_out, 10))
+        else:
+            self.transport = self.TRANSPORTS[transport]()
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = HTTPCache(cache_dir)
+            self.transport = CachingTransport(self.transport, self.cache)
+        if snapshot_dir is not None:
+            self.provider = NDJSONUserProvider(
+                UserDeserializer(),
+                NDJSONTodoProvider(
+                    TodoDeserializer(), os.path.join(snapshot_dir, TODOS_FILE)),
+                os.path.join(snapshot_dir, USERS_FILE),
+                columnar=columnar,
+                shard=shard
+            )
+        elif fan_out > 0:
+            self.provider = APIFanOutUserProvider(
+                UserDeserializer(),
+                APIUserTodoProvider(
+                    TodoDeserializer(), transport=self.transport),
+                max_workers=fan_out,
+                transport=self.transport,
+                shard=shard
+            )
+        else:
+            self.provider = APIUserProvider(
+                UserDeserializer(),
+                APITodoProvider(
+                    TodoDeserializer(), transport=self.transport),
+                transport=self.transport,
+                columnar=columnar,
+                shard=shard
+            )
+        if binary_snapshot is not None:
+            self.provider = SnapshotUserProvider(
+                self.provider,
+                BinarySnapshot(binary_snapshot, self._snapshot_source(shard),
+                               binary_snapshot_max_age),
+                columnar=columnar
+            )
         self.builder_class = DefaultUserBuilder
         self.writer_class = FileSystemWriter
+        self.shard = shard
+        # Shards running side by side keep their own state files
+        self.manifest = ReportManifest(
+            file_name=shard.file_name(ReportManifest.FILE_NAME) if shard else None)
+        self.sync_batch = SyncBatch(fsync_batch, self._published) if fsync_batch > 0 else None
+        self.report_index = ReportIndex(
+            file_name=shard.file_name(ReportIndex.FILE_NAME) if shard else None)
+        self.layout = ReportLayout(FileSystemWriter.TASK_DIRECTORY, layout_levels)
+        self.writer_options = {'fsync': fsync, 'sync_batch': self.sync_batch,
+                               'report_index': self.report_index, 'layout': self.layout}
+        self.archiver = archiver
+        if archiver is not None:
+            archiver.layout = self.layout
+        self.fingerprints = None
+        if delta:
+            self.fingerprints = UserFingerprints(
+                file_name=shard.file_name(UserFingerprints.FILE_NAME) if shard else None)
+        self.container: 'ReportContainer' = None
+        if output != 'files':
+            from medrocket_test_task import bulk  # pylint: disable=import-outside-toplevel
+            class_name, default_path = self.CONTAINERS[output]
+            if output_path is None:
+                output_path = shard.file_name(default_path) if shard else default_path
+            self.container = getattr(bulk, class_name)(output_path)
+            self.writer_class = bulk.ContainerWriter
+            self.writer_options = {'container': self.container}
+
+    def _snapshot_source(self, shard: Optional[Shard]) -> str:
+        """Describes the data a binary snapshot is made of, other sources reject it"""
+        provider = self.provider
+        if isinstance(provider, NDJSONUserProvider):
+            files = []
+            for path in (provider.path, provider.todo_provider.path):
+                stat = os.stat(path)
+                files.append(f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}')
+            source = ' '.join(files)
+        else:
+            source = f'{provider.USERS_END_POINT} {provider.todo_provider.TODO_END_POINT}'
+        if shard is not None:
+            source += f' shard {shard}'
+        return source
 
     def run(self):
         """Starts controller"""
-        users = self.provider.get_users()
+        if self.profile_dir is None:
+            self._run()
+            return
+        # cProfile and tracemalloc are loaded by profiled runs only
+        # pylint: disable=import-outside-toplevel
+        from medrocket_test_task.profiling import StageProfiler
+        profiler = StageProfiler(self.profile_dir)
+        profiler.start()
+        Metrics.profiler = profiler
+        try:
+            self._run()
+        finally:
+            Metrics.profiler = None
+            profiler.dump()
+            Logger.info(f'Stage profiles are written to {self.profile_dir}')
+            Logger.flush()
+
+    def _run(self):
+        with Metrics.timer('fetch'):
+            users = self.provider.iter_users()
+        users = Metrics.timed_iter('fetch', users)
+        if self.fingerprints is not None:
+            users = self.fingerprints.filter(users)
+        if self.pipeline:
+            import asyncio  # pylint: disable=import-outside-toplevel
+            written, errors = asyncio.run(self._run_pipeline(users))
+        elif self.workers > 1:
+            written, errors = self._run_parallel(users)
+        else:
+            written, errors = self._run_sequential(users)
+        if self.sync_batch is not None:
+            self.sync_batch.flush()
+            written += self.sync_batch.published
+        if self.container is not None:
+            self.container.close()
+        for error in errors:
+            Logger.error(error)
+        self.manifest.save()
+        if self.fingerprints is not None:
+            self.fingerprints.save()
+        # Old reports of every shard are packed by the first one,
+        # which updates the report indexes of all shards
+        if self.archiver is not None and (self.shard is None or self.shard.index == 0):
+            with Metrics.timer('rotate'):
+                self.archiver.report_index = ReportIndexGroup(self.layout.directory,
+                                                              self.report_index)
+                self.archiver.rotate()
+                self.archiver.report_index.close()
+        self.report_index.close()
+        Metrics.increment('reports_written', written)
+        Metrics.increment('reports_skipped', self.manifest.skipped)
+        Metrics.increment('errors', len(errors))
+        Logger.info(f'{written} reports written, '
+                    f'{self.manifest.skipped} unchanged reports skipped')
+        Metrics.report()
+        Logger.info('Transport: ' + self.transport.stats.summary())
+        if self.cache is not None:
+            self.cache.save()
+            Logger.info('HTTP cache: ' + self.cache.report())
+        Logger.info('The script has finished working')
+        Logger.flush()
+
+    def _run_sequential(self, users: Iterable[User]) -> Tuple[int, List[str]]:
+        written = 0
+        errors = []
         for user in users:
             try:
-                builder = self.builder_class(user)
-                writer = self.writer_class(user)
-                document = builder.build()
-                writer.write(document)
+                if self._process_user(user):
+                    written += 1
             except Exception as error:
-                Logger.error(str(error))
-        Logger.info('The script has finished working')
+                errors.append(str(error))
+        return written, errors
+
+    def _run_parallel(self, users: Iterable[User]) -> Tuple[int, List[str]]:
+        """Builds and writes users on worker pools, errors keep the user order"""
+        written = 0
+        errors = []
+        pending: Deque[Future] = deque()
+
+        def collect():
+            nonlocal written
+            try:
+                if pending.popleft().result():
+                    written += 1
+            except Exception as error:
+                errors.append(str(error))
+
+        with ExitStack() as stack:
+            writers = stack.enter_context(ThreadPoolExecutor(self.workers))
+            builders = None
+            if self.build_processes:
+                builders = stack.enter_context(self._process_pool())
+            for user in users:
+                date = datetime.now()
+                document = None
+                if builders is not None:
+                    document = builders.submit(build_document, self.builder_class, user, date)
+                pending.append(writers.submit(self._process_user, user, document, date))
+                if len(pending) >= self.workers * self.PENDING_PER_WORKER:
+                    collect()
+            while pending:
+                collect()
+        return written, errors
+
+    async def _run_pipeline(self, users: Iterable[User]) -> Tuple[int, List[str]]:
+        """
+        Runs fetch, build and write as concurrent stages connected by bounded queues,
+        a full queue pauses the previous stage, errors keep the user order
+        """
+        import asyncio  # pylint: disable=import-outside-toplevel
+        loop = asyncio.get_running_loop()
+        queue_size = self.workers * self.PENDING_PER_WORKER
+        built: asyncio.Queue = asyncio.Queue(queue_size)
+        fetched: asyncio.Queue = asyncio.Queue(queue_size)
+        written = 0
+        errors: List[Tuple[int, str]] = []
+
+        async def build(builders):
+            while True:
+                index, user, date = await fetched.get()
+                try:
+                    with Metrics.timer('build'):
+                        text = await loop.run_in_executor(
+                            builders, build_document, self.builder_class, user, date)
+                    await built.put((index, user, date, text))
+                except Exception as error:
+                    errors.append((index, str(error)))
+                finally:
+                    fetched.task_done()
+
+        async def write(writers):
+            nonlocal written
+            while True:
+                index, user, date, text = await built.get()
+                try:
+                    if await loop.run_in_executor(writers, self._write_document,
+                                                  user, date, text):
+                        written += 1
+                except Exception as error:
+                    errors.append((index, str(error)))
+                finally:
+                    built.task_done()
+
+        with ExitStack() as stack:
+            fetchers = stack.enter_context(ThreadPoolExecutor(1))
+            writers = stack.enter_context(ThreadPoolExecutor(self.workers))
+            builders = writers
+            if self.build_processes:
+                builders = stack.enter_context(self._process_pool())
+            tasks = [loop.create_task(build(builders)) for _ in range(self.workers)]
+            tasks += [loop.create_task(write(writers)) for _ in range(self.workers)]
+            try:
+                iterator = iter(users)
+                index = 0
+                while True:
+                    # The provider blocks on the network, so it runs on its own thread,
+                    # users are taken in batches to pay for the thread switch once
+                    batch = await loop.run_in_executor(
+                        fetchers, list, islice(iterator, self.FETCH_BATCH))
+                    if not batch:
+                        break
+                    for user in batch:
+                        await fetched.put((index, user, datetime.now()))
+                        index += 1
+                await fetched.join()
+                await built.join()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return written, [error for _, error in sorted(errors)]
+
+    def _process_pool(self):
+        """Returns pool of --workers processes, multiprocessing is loaded on demand"""
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(self.workers)
+
+    def _process_user(self, user: User, document: Optional[Future] = None,
+                      date: datetime = None) -> bool:
+        """Builds and writes user document, returns True if it was written"""
+        if date is None:
+            date = datetime.now()
+        if document is None and self.stream_reports:
+            # Building happens while the writer consumes the chunks
+            writer = self.writer_class(user, self.manifest, generated_at=date,
+                                       **self.writer_options)
+            with Metrics.timer('build_and_write'):
+                return self._confirm(user, writer.write(
+                    self.builder_class(user, date).iter_build()))
+
+        with Metrics.timer('build'):
+            if document is None:
+                text = build_document(self.builder_class, user, date)
+            else:
+                text = document.result()
+        return self._write_document(user, date, text)
+
+    def _write_document(self, user: User, date: datetime, text: str) -> bool:
+        """Writes built user document, returns True if it was written"""
+        writer = self.writer_class(user, self.manifest, generated_at=date,
+                                   **self.writer_options)
+        with Metrics.timer('write'):
+            return self._confirm(user, writer.write(text))
+
+    def _confirm(self, user: User, result: WriteResult) -> bool:
+        """
+        Remembers fingerprint of the written or unchanged user,
+        users whose report failed are rebuilt next run, batched ones wait for publication
+        """
+        if self.fingerprints is not None and (result or result is WriteResult.UNCHANGED):
+            self.fingerprints.confirm(user)
+        return bool(result)
+
+    def _published(self, user: User):
+        """Remembers fingerprint of the user whose batched report was published"""
+        if self.fingerprints is not None:
+            self.fingerprints.confirm(user)
+
+
+def parse_args(args=None) -> argparse.Namespace:
+    """Parses command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fan-out', type=int, default=0, metavar='N',
+                        help='fetch todos per user with N parallel requests')
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help='read users and todos from NDJSON snapshot files in DIR '
+                             'instead of the API')
+    parser.add_argument('--binary-snapshot', metavar='FILE',
+                        help='load validated users and todos from FILE, '
+                             'or save them there after fetching')
+    parser.add_argument('--binary-snapshot-max-age', type=float, default=3600,
+                        metavar='SECONDS',
+                        help='fetch again when the binary snapshot is older than SECONDS')
+    parser.add_argument('--transport', choices=list(AppController.TRANSPORTS),
+                        default='requests',
+                        help='download with a pooled requests session or the standard library')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='revalidate responses cached in DIR instead of downloading them')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='build and write reports on N worker threads')
+    parser.add_argument('--build-processes', action='store_true',
+                        help='build reports on a process pool of --workers processes')
+    parser.add_argument('--columnar', action='store_true',
+                        help='keep todos in a columnar store instead of Todo objects')
+    parser.add_argument('--stream-reports', action='store_true',
+                        help='write reports chunk by chunk while they are built')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='fetch, build and write concurrently through bounded queues')
+    parser.add_argument('--shard', type=Shard.parse, metavar='I/N',
+                        help='process only the I-th of N disjoint parts of the users, I from 0')
+    parser.add_argument('--delta', action='store_true',
+                        help='rebuild only reports of users whose data changed since the last run')
+    parser.add_argument('--fsync', action='store_true',
+                        help='sync every report to disk before publishing it')
+    parser.add_argument('--fsync-batch', type=int, default=0, metavar='N',
+                        help='sync and publish reports in batches of N')
+    parser.add_argument('--layout-levels', type=int, default=0, metavar='N',
+                        help='spread reports over N levels of hash named directories')
+    parser.add_argument('--output', choices=['files', *AppController.CONTAINERS],
+                        default='files',
+                        help='write a file per report or every report into one container')
+    parser.add_argument('--output-path', metavar='PATH',
+                        help='path of the zip or sqlite container')
+    parser.add_argument('--rotate', action='store_true',
+                        help='pack old reports into monthly zip archives')
+    parser.add_argument('--keep-last', type=int, metavar='N',
+                        help='keep only N archived versions of every report')
+    parser.add_argument('--max-age-days', type=int, metavar='N',
+                        help='remove archived versions older than N days')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write CPU profiles and memory peaks of every stage to DIR')
+    parser.add_argument('--log-level', choices=list(Logger.LEVELS), default='info',
+                        help='minimal level of printed messages')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text',
+                        help='print colored text or JSON lines')
+    parser.add_argument('--log-timestamps', action='store_true',
+                        help='prefix text messages with the time')
+    parser.add_argument('--log-buffer', type=int, default=0, metavar='N',
+                        help='write log messages in batches of N lines')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print a warning for every invalid record instead of summaries')
+    arguments = parser.parse_args(args)
+    if arguments.delta and arguments.output != 'files':
+        # A container holds only the reports of its own run
+        parser.error('--delta can not be combined with --output zip or sqlite, '
+                     'unchanged users would be missing from the container')
+    return arguments
+
+
+def create_controller(arguments: argparse.Namespace) -> AppController:
+    """Configures logging and returns controller for the parsed arguments"""
+    Logger.configure(level=arguments.log_level,
+                     json_lines=arguments.log_format == 'json',
+                     timestamps=arguments.log_timestamps,
+                     buffer_size=arguments.log_buffer,
+                     verbose=arguments.verbose)
+    archiver = None
+    if arguments.rotate:
+        # zipfile is loaded by rotating runs only
+        # pylint: disable=import-outside-toplevel
+        from medrocket_test_task.archive import ReportArchiver
+        archiver = ReportArchiver(keep_last=arguments.keep_last,
+                                  max_age_days=arguments.max_age_days)
+    return AppController(fan_out=arguments.fan_out,
+                         cache_dir=arguments.cache_dir,
+                         workers=arguments.workers,
+                         build_processes=arguments.build_processes,
+                         columnar=arguments.columnar,
+                         stream_reports=arguments.stream_reports,
+                         fsync=arguments.fsync,
+                         fsync_batch=arguments.fsync_batch,
+                         archiver=archiver,
+                         layout_levels=arguments.layout_levels,
+                         output=arguments.output,
+                         output_path=arguments.output_path,
+                         pipeline=arguments.pipeline,
+                         delta=arguments.delta,
+                         shard=arguments.shard,
+                         profile_dir=arguments.profile,
+                         transport=arguments.transport,
+                         snapshot_dir=arguments.snapshot,
+                         binary_snapshot=arguments.binary_snapshot,
+                         binary_snapshot_max_age=arguments.binary_snapshot_max_age)
 
 
 if __name__ == '__main__':
-    AppController().run()
+    create_controller(parse_args()).run()
@@ -0,0 +1,258 @@
+"""
+Rotation of archived reports into compressed archives\n
+Usage: python -m medrocket_test_task.archive show USERNAME 2022-08-01T12:30
+"""
+
+import argparse
+import json
+import os
+import zipfile
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from medrocket_test_task.index import ReportIndex, ReportIndexGroup
+from medrocket_test_task.logging import Logger
+from medrocket_test_task.paths import DATE_FORMAT, ReportFile, ReportLayout
+from medrocket_test_task.writers import FileSystemWriter
+
+
+class ReportArchiver:  # pylint: disable=too-many-instance-attributes
+    """
+    Packs old_<username>_<date>.txt reports into one zip archive per month
+    and keeps an index of every packed version
+    """
+    ARCHIVE_DIRECTORY: str = 'archive'
+    INDEX_FILE: str = 'index.json'
+
+    def __init__(self, directory: str = None, keep_last: int = None,
+                 max_age_days: int = None,
+                 report_index: Union[ReportIndex, ReportIndexGroup] = None,
+                 layout: ReportLayout = None) -> None:
+        if directory is None:
+            directory = FileSystemWriter.TASK_DIRECTORY if layout is None else layout.directory
+        if layout is None:
+            layout = ReportLayout(directory)
+        self.directory = directory
+        self.layout = layout
+        self.archive_directory = os.path.join(directory, self.ARCHIVE_DIRECTORY)
+        self.keep_last = keep_last
+        self.max_age_days = max_age_days
+        self.report_index = report_index
+        # username -> [[date, archive name, member name], ...] sorted by date,
+        # archive name -> [size, mtime in ns] of the archive the index was saved with
+        self.index: Dict[str, List[List[str]]] = dict()
+        self.archives: Dict[str, List[int]] = dict()
+        self._load_index()
+
+    def rotate(self, now: datetime = None) -> int:
+        """Packs old reports, applies retention policy, returns count of packed reports"""
+        if now is None:
+            now = datetime.now()
+        checked = self._index_missing_members()
+        packed = self._pack()
+        removed = self._apply_retention(now)
+        if checked or removed:
+            self._save_index()
+        Logger.info(f'Archived {packed} old reports, removed {removed} by retention policy')
+        return packed
+
+    def versions(self, username: str) -> List[datetime]:
+        """Returns dates of archived reports of the user"""
+        return [datetime.strptime(date, DATE_FORMAT) for date, _, _ in self.index.get(username, [])]
+
+    def retrieve(self, username: str, date: datetime) -> Optional[str]:
+        """Returns archived report without unpacking anything else"""
+        wanted = date.strftime(DATE_FORMAT)
+        for entry_date, archive_name, member in self.index.get(username, []):
+            if entry_date == wanted:
+                path = os.path.join(self.archive_directory, archive_name)
+                with zipfile.ZipFile(path) as archive:
+                    return archive.read(member).decode('utf-8')
+        return None
+
+    def _pack(self) -> int:
+        by_archive: Dict[str, List[ReportFile]] = dict()
+        for report in self.layout.iter_reports():
+            if report.date is not None:
+                archive_name = report.date.strftime('%Y-%m') + '.zip'
+                by_archive.setdefault(archive_name, []).append(report)
+        if not by_archive:
+            return 0
+
+        os.makedirs(self.archive_directory, exist_ok=True)
+        packed = 0
+        for archive_name, reports in by_archive.items():
+            path = os.path.join(self.archive_directory, archive_name)
+            members = []
+            with zipfile.ZipFile(path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+                existing = set(archive.namelist())
+                for report in reports:
+                    date = report.date.strftime(DATE_FORMAT)
+                    member = f'{report.username}/{date}.txt'
+                    if member not in existing:
+                        archive.write(report.path, member)
+                    if not self._is_indexed(report.username, archive_name, member):
+                        self._add_to_index(report.username, date, archive_name, member)
+                    members.append((report.path, member))
+            # Sources are removed only once the archive and the index know the members
+            self._save_index()
+            for report_path, member in members:
+                os.remove(report_path)
+                if self.report_index is not None:
+                    # Members are addressed like zipfile.Path does
+                    self.report_index.move(report_path, os.path.join(path, member))
+                packed += 1
+        return packed
+
+    def _index_missing_members(self) -> int:
+        """
+        Indexes members packed by a run that stopped before saving the index,
+        only archives changed since the index was saved are opened, returns their count
+        """
+        checked = 0
+        indexed = None
+        for archive_name, path in self._iter_archives():
+            if self.archives.get(archive_name) == self._archive_state(path):
+                continue
+            checked += 1
+            if indexed is None:
+                indexed = {(entry[1], entry[2])
+                           for entries in self.index.values() for entry in entries}
+            try:
+                with zipfile.ZipFile(path) as archive:
+                    members = archive.namelist()
+            except zipfile.BadZipFile:
+                Logger.warn(f'Archive {archive_name} is corrupted, it is skipped')
+                continue
+            for member in members:
+                username, _, file_name = member.rpartition('/')
+                date = file_name[:-len('.txt')]
+                if username and (archive_name, member) not in indexed:
+                    self._add_to_index(username, date, archive_name, member)
+                    indexed.add((archive_name, member))
+        return checked
+
+    def _iter_archives(self) -> Iterator[Tuple[str, str]]:
+        """Yields names and paths of the monthly archives"""
+        if not os.path.isdir(self.archive_directory):
+            return
+        for archive_name in sorted(os.listdir(self.archive_directory)):
+            if archive_name.endswith('.zip'):
+                yield archive_name, os.path.join(self.archive_directory, archive_name)
+
+    @staticmethod
+    def _archive_state(path: str) -> List[int]:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _is_indexed(self, username: str, archive_name: str, member: str) -> bool:
+        return any(entry[1:] == [archive_name, member] for entry in self.index.get(username, []))
+
+    def _add_to_index(self, username: str, date: str, archive_name: str, member: str):
+        entries = self.index.setdefault(username, [])
+        entries.append([date, archive_name, member])
+        entries.sort()
+
+    def _apply_retention(self, now: datetime) -> int:
+        """Removes versions beyond keep_last and older than max_age_days"""
+        if self.keep_last is None and self.max_age_days is None:
+            return 0
+        oldest = None
+        if self.max_age_days is not None:
+            oldest = (now - timedelta(days=self.max_age_days)).strftime(DATE_FORMAT)
+
+        removed_members: Dict[str, set] = dict()
+        for username, entries in list(self.index.items()):
+            kept = entries
+            if self.keep_last is not None:
+                kept = kept[-self.keep_last:] if self.keep_last > 0 else []
+            if oldest is not None:
+                kept = [entry for entry in kept if entry[0] >= oldest]
+            for entry in entries:
+                if entry not in kept:
+                    removed_members.setdefault(entry[1], set()).add(entry[2])
+            if kept:
+                self.index[username] = kept
+            else:
+                del self.index[username]
+
+        for archive_name, members in removed_members.items():
+            self._remove_members(archive_name, members)
+            if self.report_index is not None:
+                path = os.path.join(self.archive_directory, archive_name)
+                for member in members:
+                    self.report_index.remove(os.path.join(path, member))
+        return sum(len(members) for members in removed_members.values())
+
+    def _remove_members(self, archive_name: str, members: set):
+        """Rewrites the archive without the members, zip has no in-place delete"""
+        path = os.path.join(self.archive_directory, archive_name)
+        temp_path = path + '.tmp'
+        kept = 0
+        with zipfile.ZipFile(path) as source, \
+                zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                if info.filename not in members:
+                    target.writestr(info, source.read(info))
+                    kept += 1
+        if kept:
+            os.replace(temp_path, path)
+        else:
+            os.remove(temp_path)
+            os.remove(path)
+
+    def _load_index(self):
+        path = os.path.join(self.archive_directory, self.INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as index:
+                data = json.load(index)
+        except ValueError:
+            Logger.warn('Archive index is corrupted, it will be rebuilt from the archives')
+            return
+        if isinstance(data.get('users'), dict):
+            self.index = data['users']
+            self.archives = data.get('archives', dict())
+        else:
+            # Indexes saved without archive states, every archive is checked once
+            self.index = data
+
+    def _save_index(self):
+        """Saves the index, it knows every member of the archives as they are now"""
+        self.archives = {archive_name: self._archive_state(path)
+                         for archive_name, path in self._iter_archives()}
+        path = os.path.join(self.archive_directory, self.INDEX_FILE)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as index:
+            json.dump({'users': self.index, 'archives': self.archives}, index)
+        os.replace(temp_path, path)
+
+
+def main(args: List[str] = None):
+    """Prints archived versions or a single archived report"""
+    parser = argparse.ArgumentParser(description='Reads archived reports')
+    parser.add_argument('--directory', default=FileSystemWriter.TASK_DIRECTORY)
+    commands = parser.add_subparsers(dest='command', required=True)
+    versions = commands.add_parser('versions', help='list archived versions of a user')
+    versions.add_argument('username')
+    show = commands.add_parser('show', help='print archived report')
+    show.add_argument('username')
+    show.add_argument('date', help='report date as YYYY-MM-DDTHH:MM')
+    arguments = parser.parse_args(args)
+
+    archiver = ReportArchiver(arguments.directory)
+    if arguments.command == 'versions':
+        for date in archiver.versions(arguments.username):
+            print(date.strftime(DATE_FORMAT))
+    else:
+        report = archiver.retrieve(arguments.username,
+                                   datetime.strptime(arguments.date, DATE_FORMAT))
+        if report is None:
+            Logger.error('Report is not found')
+        else:
+            print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+End-to-end benchmarks on synthetic data\n
+Usage: python -m medrocket_test_task.benchmarks --todos 100000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from medrocket_test_task.builders import DefaultUserBuilder
+from medrocket_test_task.deserializers import TodoDeserializer, UserDeserializer
+from medrocket_test_task.ndjson import NDJSONUserProvider
+from medrocket_test_task.streaming import iter_json_array
+from medrocket_test_task.transport import RequestsTransport
+from medrocket_test_task.writers import FileSystemWriter
+
+MASK_64 = (1 << 64) - 1
+
+# Modules the script must not import before a run needs them
+LAZY_MODULES = ('requests', 'urllib3', 'asyncio', 'multiprocessing', 'zipfile',
+                'cProfile', 'tracemalloc', 'urllib.request', 'ssl')
+
+WORDS = ('delectus', 'aut', 'autem', 'quis', 'ut', 'nam', 'facere', 'fugiat',
+         'veniam', 'minus', 'et', 'porro', 'tempora', 'laboriosam', 'mollitia',
+         'qui', 'nihil', 'illo', 'expedita', 'consequatur', 'quia', 'in')
+
+
+class SyntheticDataset:
+    """Deterministic users and todos shaped like the production API"""
+    TITLES: int = 16384
+
+    def __init__(self, users: int, todos: int, seed: int = 0) -> None:
+        self.users = users
+        self.todos = todos
+        self.seed = seed
+        self._titles: List[str] = None
+
+    def iter_users(self) -> Iterator[Dict]:
+        """Yields raw user records"""
+        for user_id in range(1, self.users + 1):
+            yield {
+                'id': user_id,
+                'name': f'User {user_id}',
+                'username': f'user{user_id}',
+                'email': f'user{user_id}@example.com',
+                'address': {'street': 'Kulas Light', 'city': 'Gwenborough'},
+                'phone': '1-770-736-8031 x56442',
+                'website': 'hildegard.org',
+                'company': {
+                    'name': f'Company {user_id % 97}',
+                    'catchPhrase': 'Multi-layered client-server neural-net',
+                    'bs': 'harness real-time e-markets'
+                }
+            }
+
+    def iter_todos(self, user_id: int = None) -> Iterator[Dict]:
+        """
+        Yields raw todo records, optionally of a single user\n
+        Every todo is derived from its id alone, so a user's todos are made
+        without generating the others
+        """
+        if user_id is None:
+            todo_ids = range(1, self.todos + 1)
+        elif 1 <= user_id <= self.users:
+            todo_ids = range(user_id, self.todos + 1, self.users)
+        else:
+            todo_ids = range(0)
+        for todo_id in todo_ids:
+            yield self.todo(todo_id)
+
+    def todo(self, todo_id: int) -> Dict:
+        """Returns the todo with the id, owners take turns"""
+        if self._titles is None:
+            generator = random.Random(self.seed)
+            self._titles = [' '.join(generator.choices(WORDS, k=generator.randint(2, 12)))
+                            for _ in range(self.TITLES)]
+        # Multiplicative hash of the id picks the title and the status
+        state = (todo_id * 0x9E3779B97F4A7C15 + self.seed) & MASK_64
+        return {'userId': (todo_id - 1) % self.users + 1, 'id': todo_id,
+                'title': self._titles[(state >> 32) % self.TITLES],
+                'completed': bool(state >> 63)}
+
+
+def iter_json_chunks(records: Iterator[Dict], batch: int = 1000) -> Iterator[bytes]:
+    """Encodes records as a JSON array in chunks"""
+    yield b'['
+    first = True
+    buffer = []
+    for record in records:
+        if not first:
+            buffer.append(',')
+        first = False
+        buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(buffer) >= batch:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+    buffer.append(']')
+    yield ''.join(buffer).encode('utf-8')
+
+
+class LocalAPIServer:
+    """Serves /users and /todos of a dataset like json.medrocket.ru"""
+
+    def __init__(self, dataset: SyntheticDataset) -> None:
+        server = self
+        self.dataset = dataset
+
+        class Handler(BaseHTTPRequestHandler):
+            """Streams dataset records"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Answers GET request"""
+                url = urlsplit(self.path)
+                if url.path == '/users':
+                    records = server.dataset.iter_users()
+                elif url.path == '/todos':
+                    user_id = parse_qs(url.query).get('userId')
+                    records = server.dataset.iter_todos(
+                        int(user_id[0]) if user_id else None)
+                else:
+                    self.send_error(404)
+                    return
+                # HTTP/1.0 response, the body ends when the connection closes
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.end_headers()
+                for chunk in iter_json_chunks(records):
+                    self.wfile.write(chunk)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Keeps benchmark output clean"""
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def __enter__(self) -> 'LocalAPIServer':
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StageRecorder:
+    """Times stages and records their throughput and memory"""
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict] = dict()
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0, unit: str = 'records'):
+        """Times the block, the yielded dict may update the item count"""
+        record = {'items': items, 'unit': unit}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        yield record
+        seconds = time.perf_counter() - started
+        record['seconds'] = round(seconds, 6)
+        record['items_per_second'] = round(record['items'] / seconds, 1) if seconds else None
+        record['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.trace_memory:
+            record['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        self.stages[name] = record
+
+
+def measure_import(module: str = 'main', repeat: int = 5) -> Tuple[float, List[str]]:
+    """
+    Imports the module in fresh interpreters, returns the fastest import time
+    in milliseconds and lazy modules it added to those loaded at startup
+    """
+    # site-packages .pth files may import some of them before the module
+    code = (f'import sys; startup = set(sys.modules); import {module}; '
+            f'print(",".join(m for m in {LAZY_MODULES!r} '
+            f'if m in sys.modules and m not in startup))')
+    best = None
+    loaded: List[str] = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        # The last line of -X importtime is the module itself: self | cumulative | name
+        line = [line for line in result.stderr.splitlines()
+                if line.startswith('import time:')][-1]
+        milliseconds = int(line.split('|')[1]) / 1000
+        best = milliseconds if best is None else min(best, milliseconds)
+        loaded = [name for name in result.stdout.strip().split(',') if name]
+    return best, loaded
+
+
+def run_stages(server: LocalAPIServer, recorder: StageRecorder, directory: str):
+    """Runs every pipeline stage separately on the served dataset"""
+    transport = RequestsTransport()
+
+    with recorder.stage('fetch', unit='bytes') as record:
+        users_body = b''.join(transport.iter_chunks(server.url + '/users'))
+        todos_path = os.path.join(directory, 'todos.json')
+        with open(todos_path, 'wb') as todos_file:
+            for chunk in transport.iter_chunks(server.url + '/todos'):
+                todos_file.write(chunk)
+        record['items'] = transport.stats.bytes_received
+
+    def read_todos():
+        with open(todos_path, 'rb') as todos_file:
+            yield from iter(lambda: todos_file.read(64 * 1024), b'')
+
+    with recorder.stage('decode') as record:
+        user_dicts = list(iter_json_array([users_body]))
+        todo_dicts = list(iter_json_array(read_todos()))
+        record['items'] = len(user_dicts) + len(todo_dicts)
+    del users_body
+
+    with recorder.stage('deserialize') as record:
+        users = UserDeserializer().deserialize_many(user_dicts).objects
+        todos = TodoDeserializer().deserialize_many(todo_dicts).objects
+        record['items'] = len(users) + len(todos)
+    del user_dicts, todo_dicts
+
+    with recorder.stage('join', len(todos)):
+        users_by_id = {user.id: user for user in users}
+        for todo in todos:
+            user = users_by_id.get(todo.user_id)
+            if user is not None:
+                user.tasks.append(todo)
+    del todos
+
+    with recorder.stage('build', len(users), unit='reports'):
+        documents = [DefaultUserBuilder(user).build() for user in users]
+
+    with recorder.stage('write', len(users), unit='reports'):
+        for user, document in zip(users, documents):
+            writer = FileSystemWriter(user)
+            writer.TASK_DIRECTORY = os.path.join(directory, 'tasks')
+            writer.write(document)
+
+
+def run_end_to_end(server: LocalAPIServer, recorder: StageRecorder, directory: str,
+                   users: int, controller_args: List[str]):
+    """Runs AppController against the local server"""
+    # Imported here, main is not a part of the package
+    from main import create_controller, parse_args  # pylint: disable=import-outside-toplevel
+
+    arguments = parse_args(controller_args)
+    # Paths given by the caller stay where they point after the chdir
+    for name in ('snapshot', 'binary_snapshot', 'cache_dir', 'output_path', 'profile'):
+        if getattr(arguments, name) is not None:
+            setattr(arguments, name, os.path.abspath(getattr(arguments, name)))
+    current_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        # State files of the controller are resolved in the benchmark directory,
+        # not in a checkout the benchmark is started from
+        controller = create_controller(arguments)
+        if not isinstance(controller.provider, NDJSONUserProvider):
+            # Snapshot runs replay their files instead of the server
+            controller.provider.USERS_END_POINT = server.url + '/users'
+            controller.provider.todo_provider.TODO_END_POINT = server.url + '/todos'
+        # Logs go to stderr so stdout stays machine readable
+        with recorder.stage('end_to_end', users, unit='reports'), redirect_stdout(sys.stderr):
+            controller.run()
+    finally:
+        os.chdir(current_directory)
+
+
+def main(args: List[str] = None):
+    """Runs benchmarks and writes machine readable results"""
+    parser = argparse.ArgumentParser(description='Benchmarks the report pipeline')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--todos', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record tracemalloc peak of every stage (slow)')
+    parser.add_argument('--skip-stages', action='store_true',
+                        help='run only the end-to-end benchmark')
+    parser.add_argument('--import-budget-ms', type=float, metavar='MS',
+                        help='fail when importing main takes longer than MS '
+                             'or loads lazy modules')
+    parser.add_argument('--output', help='JSON file for the results, stdout by default')
+    parser.add_argument('controller_args', nargs='*',
+                        help='main.py arguments for the end-to-end run, after --')
+    arguments = parser.parse_args(args)
+
+    dataset = SyntheticDataset(arguments.users, arguments.todos, arguments.seed)
+    recorder = StageRecorder(arguments.trace_memory)
+    import_ms, loaded = measure_import()
+    recorder.stages['import'] = {'milliseconds': import_ms, 'lazy_modules_loaded': loaded}
+    if arguments.trace_memory:
+        tracemalloc.start()
+    with LocalAPIServer(dataset) as server:
+        if not arguments.skip_stages:
+            with tempfile.TemporaryDirectory() as directory:
+                run_stages(server, recorder, directory)
+        with tempfile.TemporaryDirectory() as directory:
+            run_end_to_end(server, recorder, directory,
+                           arguments.users, arguments.controller_args)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'users': arguments.users,
+        'todos': arguments.todos,
+        'seed': arguments.seed,
+        'controller_args': arguments.controller_args,
+        'stages': recorder.stages,
+    }
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if arguments.import_budget_ms is not None and (
+            import_ms > arguments.import_budget_ms or loaded):
+        sys.exit(f'Cold start budget exceeded: import took {import_ms:.1f}ms '
+                 f'of {arguments.import_budget_ms:.1f}ms, lazy modules loaded: {loaded}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,10 @@
 
 import abc
 from datetime import datetime
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 
-from medrocket_test_task.model import Todo, User
+from medrocket_test_task.model import User
+from medrocket_test_task.store import TodoView
 
 
 class UserBuilder(abc.ABC):
@@ -21,10 +22,15 @@ class UserBuilder(abc.ABC):
     def build_tasks(self) -> str:
         """Returns document tasks"""
 
+    def iter_build(self) -> Iterator[str]:
+        """Yields user document in chunks"""
+        yield self.build()
+
 
 class DefaultUserBuilder(UserBuilder):
     """Builds User Document"""
     MAX_TASK_LENGTH = 48
+    TITLES_PER_CHUNK = 1024
 
     def __init__(self, user: User, date: datetime = None):
         if date is None:
@@ -34,7 +40,13 @@ class DefaultUserBuilder(UserBuilder):
 
     def build(self) -> str:
         """Returns user document"""
-        return (self.build_title() + '\n\n' + self.build_tasks())
+        return ''.join(self.iter_build())
+
+    def iter_build(self) -> Iterator[str]:
+        """Yields user document in chunks"""
+        yield self.build_title()
+        yield '\n\n'
+        yield from self.iter_tasks()
 
     def build_title(self) -> str:
         """Returns document title"""
@@ -46,42 +58,58 @@ class DefaultUserBuilder(UserBuilder):
 
     def build_tasks(self) -> str:
         """Returns document tasks"""
-        completed_tasks, rest_tasks = self._group_tasks()
-        completed_tasks_names = list(map(
-            lambda t: f'{self._trim_title(t.title)}',
-            completed_tasks,
-        ))
-        rest_tasks_names = list(map(
-            lambda t: f'{self._trim_title(t.title)}',
-            rest_tasks,
-        ))
-        completed_tasks_names = '\n'.join(completed_tasks_names)
-        rest_tasks_names = '\n'.join(rest_tasks_names)
-
-        result = ''
-        if len(completed_tasks) > 0:
-            result += (f'Завершённые задачи ({len(completed_tasks)}):\n'
-                       f'{completed_tasks_names}\n\n')
-
-        if len(rest_tasks) > 0:
-            result += (f'Оставшиеся задачи ({len(rest_tasks)}):\n'
-                       f'{rest_tasks_names}')
-
-        return result.strip('\n')
-
-    def _group_tasks(self) -> Tuple[List[Todo], List[Todo]]:
+        return ''.join(self.iter_tasks())
+
+    def iter_tasks(self) -> Iterator[str]:
+        """Yields document tasks in chunks"""
+        completed_tasks, rest_tasks = self._group_titles()
+
+        def sections():
+            if len(completed_tasks) > 0:
+                yield f'Завершённые задачи ({len(completed_tasks)}):\n'
+                yield from self._iter_titles(completed_tasks)
+                yield '\n\n'
+            if len(rest_tasks) > 0:
+                yield f'Оставшиеся задачи ({len(rest_tasks)}):\n'
+                yield from self._iter_titles(rest_tasks)
+
+        # Sections start with a header, so only the trailing newlines are stripped
+        pending = ''
+        for chunk in sections():
+            body = chunk.rstrip('\n')
+            if body:
+                yield pending + body
+                pending = chunk[len(body):]
+            else:
+                pending += chunk
+
+    def _iter_titles(self, titles: List[str]) -> Iterable[str]:
+        """Yields trimmed titles separated by new lines, several titles per chunk"""
+        for start in range(0, len(titles), self.TITLES_PER_CHUNK):
+            chunk = '\n'.join(map(self._trim_title,
+                                  titles[start:start + self.TITLES_PER_CHUNK]))
+            yield chunk if start == 0 else '\n' + chunk
+
+    def _group_titles(self) -> Tuple[List[str], List[str]]:
         """
-        Groups tasks by completion status\n
-        Returns (completed_tasks, rest_tasks)
+        Groups task titles by completion status\n
+        Returns (completed_titles, rest_titles)
         """
-        completed_tasks = []
-        rest_tasks = []
-        for task in self.user.tasks:
-            if task.completed:
-                completed_tasks.append(task)
+        completed_titles = []
+        rest_titles = []
+        for title, completed in self._iter_title_status():
+            if completed:
+                completed_titles.append(title)
             else:
-                rest_tasks.append(task)
-        return (completed_tasks, rest_tasks)
+                rest_titles.append(title)
+        return (completed_titles, rest_titles)
+
+    def _iter_title_status(self) -> Iterator[Tuple[str, bool]]:
+        """Yields (title, completed) of user tasks, columnar views skip Todo objects"""
+        tasks = self.user.tasks
+        if isinstance(tasks, TodoView):
+            return tasks.iter_title_status()
+        return ((task.title, task.completed) for task in tasks)
 
     def _trim_title(self, title: str) -> str:
         if len(title) > DefaultUserBuilder.MAX_TASK_LENGTH:
@@ -0,0 +1,160 @@
+"""Writers putting every report of a run into a single container"""
+
+import abc
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator, Tuple, Union
+
+from medrocket_test_task.model import User
+from medrocket_test_task.writers import WriteResult, Writer
+
+
+class ReportContainer(abc.ABC):
+    """Abstract container of the reports written by a run"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    @abc.abstractmethod
+    def add(self, username: str, data: Union[str, Iterable[str]], generated_at: datetime = None):
+        """Stores the report of the user"""
+
+    @abc.abstractmethod
+    def close(self):
+        """Finishes the container"""
+
+    @abc.abstractmethod
+    def iter_reports(self) -> Iterator[Tuple[str, str]]:
+        """Yields (username, report) pairs of a finished container"""
+
+
+class ZipContainer(ReportContainer):
+    """
+    Zip archive with a <username>.txt member per report,
+    it is written next to the target and replaces it when closed
+    """
+    # Streamed reports up to this size are spooled in memory
+    SPOOL_SIZE: int = 1024 * 1024
+
+    def __init__(self, path: str, compression: int = zipfile.ZIP_DEFLATED) -> None:
+        super().__init__(path)
+        self.compression = compression
+        self._archive: zipfile.ZipFile = None
+
+    def add(self, username: str, data: Union[str, Iterable[str]], generated_at: datetime = None):
+        """Adds the report as a member, chunks are spooled until the report is complete"""
+        name = username + '.txt'
+        if isinstance(data, str):
+            with self.lock:
+                self._open().writestr(name, data)
+            return
+        # A member is finalized even when its chunks fail, so only whole reports are added
+        with tempfile.SpooledTemporaryFile(self.SPOOL_SIZE) as spool:
+            for chunk in data:
+                spool.write(chunk.encode('utf-8'))
+            spool.seek(0)
+            # Only one member can be written at a time
+            with self.lock, self._open().open(name, 'w') as member:
+                shutil.copyfileobj(spool, member)
+
+    def close(self):
+        """Finishes the archive and moves it in place"""
+        with self.lock:
+            if self._archive is None:
+                return
+            self._archive.close()
+            self._archive = None
+            os.replace(self.path + '.tmp', self.path)
+
+    def iter_reports(self) -> Iterator[Tuple[str, str]]:
+        """Yields (username, report) pairs of the archive"""
+        with zipfile.ZipFile(self.path) as archive:
+            for name in archive.namelist():
+                yield name[:-len('.txt')], archive.read(name).decode('utf-8')
+
+    def _open(self) -> zipfile.ZipFile:
+        if self._archive is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._archive = zipfile.ZipFile(self.path + '.tmp', 'w', self.compression)
+        return self._archive
+
+
+class SQLiteContainer(ReportContainer):
+    """
+    SQLite table of the reports, inserted in batched transactions,
+    it is written next to the target and replaces it when closed
+    """
+    SCHEMA: str = ('CREATE TABLE IF NOT EXISTS reports ('
+                   'username TEXT PRIMARY KEY, '
+                   'generated_at TEXT, '
+                   'content TEXT NOT NULL)')
+
+    def __init__(self, path: str, batch_size: int = 1000) -> None:
+        super().__init__(path)
+        self.batch_size = batch_size
+        self.pending = []
+        self._connection: sqlite3.Connection = None
+
+    def add(self, username: str, data: Union[str, Iterable[str]], generated_at: datetime = None):
+        """Schedules the report, a full batch is inserted in one transaction"""
+        content = data if isinstance(data, str) else ''.join(data)
+        generated = generated_at.isoformat(timespec='minutes') if generated_at else None
+        with self.lock:
+            self.pending.append((username, generated, content))
+            if len(self.pending) >= self.batch_size:
+                self._insert()
+
+    def close(self):
+        """Inserts the rest of the reports, closes the database and moves it in place"""
+        with self.lock:
+            if self.pending:
+                self._insert()
+            if self._connection is None:
+                return
+            self._connection.close()
+            self._connection = None
+            os.replace(self.path + '.tmp', self.path)
+
+    def iter_reports(self) -> Iterator[Tuple[str, str]]:
+        """Yields (username, report) pairs of the database"""
+        connection = sqlite3.connect(self.path)
+        try:
+            yield from connection.execute('SELECT username, content FROM reports')
+        finally:
+            connection.close()
+
+    def _insert(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp_path = self.path + '.tmp'
+            # Left by an interrupted run
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self._connection = sqlite3.connect(temp_path, check_same_thread=False)
+            self._connection.execute(self.SCHEMA)
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO reports VALUES (?, ?, ?)', self.pending)
+        self.pending = []
+
+
+class ContainerWriter(Writer):
+    """Writes the report of a user into a container shared by the run"""
+
+    def __init__(self, user: User, _manifest=None, container: ReportContainer = None,
+                 generated_at: datetime = None, **_options) -> None:
+        # Containers hold a full snapshot, so the manifest and file options are unused
+        self.user = user
+        self.container = container
+        self.generated_at = generated_at
+
+    def write(self, data: Union[str, Iterable[str]]) -> WriteResult:
+        """Adds the report to the container"""
+        self.container.add(self.user.username, data, self.generated_at)
+        return WriteResult.WRITTEN
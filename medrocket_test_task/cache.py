@@ -0,0 +1,168 @@
+"""On-disk HTTP response cache"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, Optional
+
+from medrocket_test_task.transport import Transport, TransportResponse
+
+
+@dataclass
+class CacheEntry:
+    """Cached response metadata"""
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    size: int
+    last_used: float
+
+
+class HTTPCache:
+    """Size bounded storage of response bodies with their validators"""
+    INDEX_FILE: str = 'index.json'
+    CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(self, directory: str = '.http_cache', max_size: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Kept in least recently used first order
+        self.entries: Dict[str, CacheEntry] = self._load_index()
+        self.size = sum(entry.size for entry in self.entries.values())
+        self._dirty = False
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """Returns entry of the url if its body is still stored"""
+        entry = self.entries.get(self._key(url))
+        if entry is None or not os.path.exists(self._body_path(url)):
+            return None
+        return entry
+
+    def read(self, url: str) -> Iterator[bytes]:
+        """Yields cached body of the url"""
+        with self.lock:
+            self.hits += 1
+            entry = self.entries.pop(self._key(url))
+            entry.last_used = time.time()
+            self.entries[self._key(url)] = entry
+            self._dirty = True
+        with open(self._body_path(url), 'rb') as body:
+            while True:
+                chunk = body.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def store(self, url: str, headers: Dict[str, str], chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Yields chunks while saving them, the entry is added once the body is complete"""
+        with self.lock:
+            self.misses += 1
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            yield from chunks
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        body_path = self._body_path(url)
+        temp_path = f'{body_path}.{threading.get_ident()}.tmp'
+        size = 0
+        try:
+            with open(temp_path, 'wb') as body:
+                for chunk in chunks:
+                    body.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            with self.lock:
+                os.replace(temp_path, body_path)
+                key = self._key(url)
+                previous = self.entries.pop(key, None)
+                if previous is not None:
+                    self.size -= previous.size
+                self.entries[key] = CacheEntry(url, etag, last_modified, size, time.time())
+                self.size += size
+                self._evict()
+                self._dirty = True
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def report(self) -> str:
+        """Returns hit/miss summary"""
+        return (f'{self.hits} hits, {self.misses} misses, '
+                f'{len(self.entries)} entries, {self.size} bytes stored')
+
+    def save(self):
+        """Writes the index if entries changed since the last save"""
+        with self.lock:
+            if self._dirty:
+                self._save_index()
+                self._dirty = False
+
+    def _evict(self):
+        """Removes least recently used entries until the cache fits max_size"""
+        while self.size > self.max_size and self.entries:
+            key = next(iter(self.entries))
+            self.size -= self.entries.pop(key).size
+            path = os.path.join(self.directory, key)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_index(self) -> Dict[str, CacheEntry]:
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        if not os.path.exists(path):
+            return dict()
+        try:
+            with open(path, 'r', encoding='utf-8') as index:
+                entries = [(key, CacheEntry(**value)) for key, value in json.load(index).items()]
+            return dict(sorted(entries, key=lambda item: item[1].last_used))
+        except (ValueError, TypeError):
+            return dict()
+
+    def _save_index(self):
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as index:
+            json.dump({key: asdict(entry) for key, entry in self.entries.items()}, index)
+        os.replace(temp_path, path)
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _body_path(self, url: str) -> str:
+        return os.path.join(self.directory, self._key(url))
+
+
+class CachingTransport(Transport):
+    """Transport revalidating cached responses with conditional requests"""
+
+    def __init__(self, transport: Transport, cache: HTTPCache) -> None:
+        super().__init__()
+        self.transport = transport
+        self.cache = cache
+        self.stats = transport.stats
+
+    @contextmanager
+    def open(self, url: str, headers: Dict[str, str] = None):
+        headers = dict(headers or {})
+        entry = self.cache.get(url)
+        if entry is not None:
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        with self.transport.open(url, headers) as response:
+            if response.status_code == 304 and entry is not None:
+                yield TransportResponse(200, response.headers, self.cache.read(url))
+            else:
+                yield TransportResponse(response.status_code,
+                                        response.headers,
+                                        self.cache.store(url, response.headers, response.chunks))
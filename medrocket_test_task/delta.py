@@ -0,0 +1,90 @@
+"""Fingerprints of users for incremental runs"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, Iterator, Set
+
+from medrocket_test_task.logging import Logger, Metrics
+from medrocket_test_task.model import User
+from medrocket_test_task.writers import FileSystemWriter
+
+
+class UserFingerprints:
+    """
+    Stores a hash of the user fields and todos of every reported user,
+    so a run can skip users whose data did not change
+    """
+    FILE_NAME: str = '.fingerprints.json'
+
+    def __init__(self, directory: str = None, file_name: str = None) -> None:
+        if directory is None:
+            directory = FileSystemWriter.TASK_DIRECTORY
+        self.path = os.path.join(directory, file_name or self.FILE_NAME)
+        self.lock = threading.Lock()
+        self.fingerprints: Dict[str, str] = self._load()
+        self.pending: Dict[str, str] = dict()
+        self.seen: Set[str] = set()
+        self.counts: Dict[str, int] = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+
+    @staticmethod
+    def fingerprint(user: User) -> str:
+        """Returns hash of the user fields and the set of todos"""
+        fingerprint = hashlib.blake2b(digest_size=16)
+        fingerprint.update('\x1f'.join((str(user.id), user.name, user.username, user.email,
+                                        user.company_name)).encode('utf-8'))
+        # The order of tasks is not a part of the data
+        for todo_id, title, completed in sorted(
+                (task.id, task.title, task.completed) for task in user.tasks):
+            fingerprint.update(f'\x1e{todo_id}\x1f{int(completed)}\x1f{title}'.encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    def filter(self, users: Iterable[User]) -> Iterator[User]:
+        """Yields added and changed users, their fingerprints wait for confirm"""
+        for user in users:
+            key = str(user.id)
+            fingerprint = self.fingerprint(user)
+            with self.lock:
+                self.seen.add(key)
+                previous = self.fingerprints.get(key)
+                if previous == fingerprint:
+                    self.counts['unchanged'] += 1
+                    continue
+                self.counts['added' if previous is None else 'changed'] += 1
+                self.pending[key] = fingerprint
+            yield user
+
+    def confirm(self, user: User):
+        """Remembers the fingerprint of a user whose report was written"""
+        key = str(user.id)
+        with self.lock:
+            if key in self.pending:
+                self.fingerprints[key] = self.pending.pop(key)
+
+    def save(self):
+        """Forgets removed users, saves fingerprints and reports the counts"""
+        with self.lock:
+            removed = [key for key in self.fingerprints if key not in self.seen]
+            for key in removed:
+                del self.fingerprints[key]
+            self.counts['removed'] = len(removed)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as fingerprints:
+                json.dump(self.fingerprints, fingerprints)
+            os.replace(temp_path, self.path)
+        for name, count in self.counts.items():
+            Metrics.increment('users_' + name, count)
+        Logger.info('Users: ' + ', '.join(f'{count} {name}'
+                                          for name, count in self.counts.items()))
+
+    def _load(self) -> Dict[str, str]:
+        if not os.path.exists(self.path):
+            return dict()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fingerprints:
+                return json.load(fingerprints)
+        except ValueError:
+            Logger.warn('User fingerprints are corrupted, all reports will be rebuilt')
+            return dict()
@@ -1,15 +1,77 @@
 """Model deserializers"""
 
 import abc
-from typing import Dict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
 
 from medrocket_test_task.model import Todo, User
+from medrocket_test_task.store import TodoStore
 
 
 class DeserializationError(ValueError):
     """Should be raised when trying to deserialize invalid data"""
 
 
+@dataclass
+class DeserializationFailure:
+    """Invalid record and the reason it was rejected"""
+    index: int
+    record: Any
+    message: str
+
+
+@dataclass
+class BatchResult:
+    """Result of batch deserialization"""
+    objects: List = field(default_factory=list)
+    errors: List[DeserializationFailure] = field(default_factory=list)
+
+
+class Field(NamedTuple):
+    """Checked field of a record"""
+    path: Tuple[str, ...]
+    expected: type
+    message: str
+    aliases: Tuple[str, ...] = ()
+
+
+def compile_fields(fields: Sequence[Field]) -> Callable:
+    """
+    Generates a generator function validating records against the fields\n
+    Parents of nested paths must be checked by the preceding fields
+    """
+    lines = [
+        'def iter_many(data_dicts, errors, create):',
+        '    for index, data in enumerate(data_dicts):',
+        '        if not isinstance(data, dict):',
+        '            errors.append(Failure(index, data, "Record is not an object"))',
+        '            continue',
+        '        get = data.get',
+    ]
+    for i, checked in enumerate(fields):
+        if len(checked.path) == 1:
+            keys = checked.aliases + checked.path
+            lines.append(f'        v{i} = get({keys[0]!r})')
+            for key in keys[1:]:
+                lines.append(f'        if v{i} is None:')
+                lines.append(f'            v{i} = get({key!r})')
+        else:
+            parent = 'data' + ''.join(f'[{key!r}]' for key in checked.path[:-1])
+            lines.append(f'        v{i} = {parent}.get({checked.path[-1]!r})')
+        lines.append(f'        if not isinstance(v{i}, types[{i}]):')
+        lines.append(f'            errors.append(Failure(index, data, messages[{i}]))')
+        lines.append('            continue')
+    lines.append('        yield create(' + ', '.join(f'v{i}' for i in range(len(fields))) + ')')
+
+    namespace = {
+        'Failure': DeserializationFailure,
+        'types': tuple(checked.expected for checked in fields),
+        'messages': tuple(checked.message for checked in fields),
+    }
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return namespace['iter_many']
+
+
 class Deserializer(abc.ABC):
     """Deserializes object"""
 
@@ -21,9 +83,49 @@ class Deserializer(abc.ABC):
     def deserealize(self, **kwargs):
         """Returns object from dict"""
 
+    def deserialize_many(self, data_dicts: Iterable[Dict]) -> BatchResult:
+        """Returns valid objects and failures of invalid records"""
+        result = BatchResult()
+        result.objects.extend(self.iter_many(data_dicts, result.errors))
+        return result
+
+    def iter_many(self, data_dicts: Iterable[Dict],
+                  errors: List[DeserializationFailure]) -> Iterator:
+        """Yields valid objects, appends failures of invalid records to errors"""
+        for index, data in enumerate(data_dicts):
+            try:
+                yield self.deserealize(**data)
+            except (DeserializationError, TypeError) as error:
+                errors.append(DeserializationFailure(index, data, str(error)))
+
 
-class TodoDeserializer(Deserializer):
+class FieldDeserializer(Deserializer):
+    """Deserializes batches with checks of FIELDS compiled once per class"""
+    FIELDS: Tuple[Field, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.FIELDS:
+            cls._compiled_fields = staticmethod(compile_fields(cls.FIELDS))
+
+    @abc.abstractmethod
+    def create(self, *values):
+        """Returns object from the values of FIELDS"""
+
+    def iter_many(self, data_dicts: Iterable[Dict],
+                  errors: List[DeserializationFailure]) -> Iterator:
+        """Yields valid objects, appends failures of invalid records to errors"""
+        return self._compiled_fields(data_dicts, errors, self.create)
+
+
+class TodoDeserializer(FieldDeserializer):
     """Deserializes Todos"""
+    FIELDS = (
+        Field(('id',), int, 'Id is not a number'),
+        Field(('user_id',), int, 'user_id is not a number', aliases=('userId',)),
+        Field(('title',), str, 'Title is not specified'),
+        Field(('completed',), bool, 'Completed is not a bool'),
+    )
 
     def validate_data(self, **kwargs) -> Dict:
         """Validates data"""
@@ -45,9 +147,28 @@ class TodoDeserializer(Deserializer):
                     title=data['title'],
                     completed=data['completed'])
 
+    def create(self, *values):
+        return Todo(values[1], values[0], values[2], values[3])
 
-class UserDeserializer(Deserializer):
+    def fill_store(self, data_dicts: Iterable[Dict], store: TodoStore,
+                   errors: List[DeserializationFailure]):
+        """Appends valid records to the columnar store without creating Todo objects"""
+        def add(id_, user_id, title, completed):
+            store.add(user_id, id_, title, completed)
+        for _ in self._compiled_fields(data_dicts, errors, add):
+            pass
+
+
+class UserDeserializer(FieldDeserializer):
     """Deserializes Todos"""
+    FIELDS = (
+        Field(('id',), int, 'Id is not a number'),
+        Field(('name',), str, 'Name is not specified'),
+        Field(('username',), str, 'Username is not specified'),
+        Field(('email',), str, 'Email is not specified'),
+        Field(('company',), dict, 'Company is not specified'),
+        Field(('company', 'name'), str, 'Company name is not specified'),
+    )
 
     def validate_data(self, **kwargs) -> Dict:
         """Validates data"""
@@ -76,3 +197,6 @@ class UserDeserializer(Deserializer):
             company_name=data['company']['name'],
             tasks=[]
         )
+
+    def create(self, *values):
+        return User(values[0], values[1], values[2], values[3], values[5], [])
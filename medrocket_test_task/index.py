@@ -0,0 +1,180 @@
+"""Report metadata index"""
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from medrocket_test_task.logging import Logger
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M'
+# The index and its copies named by Shard.file_name
+INDEX_FILE = re.compile(r'^\.reports(\.shard-\d+-of-\d+)?\.sqlite3$')
+
+
+class ReportRecord(NamedTuple):
+    """Metadata of a current or archived report"""
+    username: str
+    path: str
+    generated_at: datetime
+    content_hash: Optional[str]
+    size: int
+    current: bool
+
+
+class ReportIndex:
+    """
+    SQLite table of every current and archived report,
+    external tools can query it without reading the reports
+    """
+    FILE_NAME: str = '.reports.sqlite3'
+    SCHEMA: str = ('CREATE TABLE IF NOT EXISTS reports ('
+                   'path TEXT PRIMARY KEY, '
+                   'username TEXT NOT NULL, '
+                   'generated_at TEXT NOT NULL, '
+                   'content_hash TEXT, '
+                   'size INTEGER NOT NULL, '
+                   'current INTEGER NOT NULL); '
+                   'CREATE INDEX IF NOT EXISTS reports_username ON reports (username, current)')
+    COLUMNS: str = 'username, path, generated_at, content_hash, size, current'
+    # Changes are committed in small batches, so a crash loses few rows
+    # and the write lock is released between them
+    COMMIT_EVERY: int = 64
+    # Seconds to wait for another run holding the write lock
+    BUSY_TIMEOUT: float = 30.0
+
+    def __init__(self, directory: str = 'tasks', file_name: str = None) -> None:
+        self.path = os.path.join(directory, file_name or self.FILE_NAME)
+        self.lock = threading.Lock()
+        self._connection: sqlite3.Connection = None
+        self._uncommitted = 0
+
+    def current(self, username: str) -> Optional[ReportRecord]:
+        """Returns metadata of the current report of the user"""
+        rows = self._query(f'SELECT {self.COLUMNS} FROM reports '
+                           'WHERE username = ? AND current = 1', (username,))
+        return rows[0] if rows else None
+
+    def versions(self, username: str) -> List[ReportRecord]:
+        """Returns metadata of every report of the user, the oldest first"""
+        return self._query(f'SELECT {self.COLUMNS} FROM reports '
+                           'WHERE username = ? ORDER BY generated_at, current', (username,))
+
+    def publish(self, username: str, path: str, generated_at: datetime,
+                content_hash: Optional[str], size: int, archive_path: str = None):
+        """Records the new current report, the previous one is moved to archive_path"""
+        with self.lock:
+            connection = self._connect()
+            if archive_path is None:
+                connection.execute('DELETE FROM reports WHERE username = ? AND current = 1',
+                                   (username,))
+            else:
+                connection.execute('DELETE FROM reports WHERE path = ?', (archive_path,))
+                connection.execute('UPDATE reports SET path = ?, current = 0 '
+                                   'WHERE username = ? AND current = 1',
+                                   (archive_path, username))
+            connection.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, 1)',
+                               (path, username, generated_at.strftime(DATE_FORMAT),
+                                content_hash, size))
+            self._changed()
+
+    def move(self, path: str, new_path: str):
+        """Updates the path of a moved report"""
+        with self.lock:
+            self._connect().execute('UPDATE reports SET path = ? WHERE path = ?',
+                                    (new_path, path))
+            self._changed()
+
+    def remove(self, path: str):
+        """Forgets a deleted report"""
+        with self.lock:
+            self._connect().execute('DELETE FROM reports WHERE path = ?', (path,))
+            self._changed()
+
+    def save(self):
+        """Commits recorded changes"""
+        with self.lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        """Commits recorded changes and closes the database"""
+        with self.lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+    def _changed(self):
+        """Commits a full batch of changes, the lock must be held"""
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def _query(self, sql: str, parameters: tuple) -> List[ReportRecord]:
+        with self.lock:
+            if self._connection is None and not os.path.exists(self.path):
+                return []
+            rows = self._connect().execute(sql, parameters).fetchall()
+        return [ReportRecord(username, path, datetime.strptime(generated_at, DATE_FORMAT),
+                             content_hash, size, bool(current))
+                for username, path, generated_at, content_hash, size, current in rows]
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens the database on first use, so runs without reports create nothing"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = None
+            try:
+                connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT,
+                                             check_same_thread=False)
+                connection.executescript(self.SCHEMA)
+            except sqlite3.OperationalError:
+                # A locked or unreadable index is not corrupt, it must be kept
+                if connection is not None:
+                    connection.close()
+                raise
+            except sqlite3.DatabaseError:
+                connection.close()
+                Logger.warn('Report index is corrupted, it will be recreated')
+                os.remove(self.path)
+                connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT,
+                                             check_same_thread=False)
+                connection.executescript(self.SCHEMA)
+            self._connection = connection
+        return self._connection
+
+
+class ReportIndexGroup:
+    """
+    Every report index of the directory, the unsharded one and the copies of --shard runs,
+    tools moving reports of all shards keep each of them up to date
+    """
+
+    def __init__(self, directory: str = 'tasks', opened: ReportIndex = None) -> None:
+        self.indexes: List[ReportIndex] = [] if opened is None else [opened]
+        known = {index.path for index in self.indexes}
+        if os.path.isdir(directory):
+            for file_name in sorted(os.listdir(directory)):
+                index = ReportIndex(directory, file_name)
+                if INDEX_FILE.match(file_name) and index.path not in known:
+                    self.indexes.append(index)
+
+    def move(self, path: str, new_path: str):
+        """Updates the path of a moved report in every index"""
+        for index in self.indexes:
+            index.move(path, new_path)
+
+    def remove(self, path: str):
+        """Forgets a deleted report in every index"""
+        for index in self.indexes:
+            index.remove(path)
+
+    def close(self):
+        """Commits recorded changes and closes every index"""
+        for index in self.indexes:
+            index.close()
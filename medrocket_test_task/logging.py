@@ -1,20 +1,226 @@
 """Logging classes"""
 
+import atexit
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, TextIO
+
 
 class Logger:
     """Provides logging methods"""
+    DEBUG: int = 10
+    INFO: int = 20
+    WARN: int = 30
+    ERROR: int = 40
+    LEVELS: Dict[str, int] = {'debug': DEBUG, 'info': INFO, 'warn': WARN, 'error': ERROR}
+    NAMES: Dict[int, str] = {value: name for name, value in LEVELS.items()}
+    PREFIXES: Dict[int, str] = {
+        DEBUG: ' [debug]: ',
+        INFO: ' [info]: ',
+        WARN: '\033[93m [warn]: \033[00m',
+        ERROR: '\033[91m [error]: \033[00m',
+    }
+
+    level: int = INFO
+    verbose: bool = False
+    json_lines: bool = False
+    timestamps: bool = False
+    buffer_size: int = 0
+    stream: TextIO = None
+    _buffer: List[str] = []
+    _lock = threading.Lock()
 
     @classmethod
-    def info(cls, message: str):
+    def configure(cls, level: str = 'info', json_lines: bool = False, timestamps: bool = False,
+                  buffer_size: int = 0, stream: TextIO = None, verbose: bool = False):
+        """
+        Sets minimal level and output format\n
+        With buffer_size > 0 lines are written in batches, the rest is flushed at exit\n
+        With verbose repeated warnings are printed one per record instead of summaries
+        """
+        cls.flush()
+        cls.level = cls.LEVELS[level]
+        cls.verbose = verbose
+        cls.json_lines = json_lines
+        cls.timestamps = timestamps
+        cls.buffer_size = buffer_size
+        cls.stream = stream
+
+    @classmethod
+    def debug(cls, message: str, **fields):
+        """Prints debug message"""
+        cls.log(cls.DEBUG, message, **fields)
+
+    @classmethod
+    def info(cls, message: str, **fields):
         """Prints info"""
-        print(' [info]: ' + message)
+        cls.log(cls.INFO, message, **fields)
 
     @classmethod
-    def warn(cls, message: str):
+    def warn(cls, message: str, **fields):
         """Prints warning"""
-        print('\033[93m [warn]: \033[00m' + message)
+        cls.log(cls.WARN, message, **fields)
 
     @classmethod
-    def error(cls, message: str):
+    def error(cls, message: str, **fields):
         """Prints error"""
-        print('\033[91m [error]: \033[00m' + message)
+        cls.log(cls.ERROR, message, **fields)
+
+    @classmethod
+    def is_enabled(cls, level: int) -> bool:
+        """Checks if messages of the level are printed"""
+        return level >= cls.level
+
+    @classmethod
+    def log(cls, level: int, message: str, **fields):
+        """Formats and prints the message if its level is enabled"""
+        if level < cls.level:
+            return
+        if cls.json_lines:
+            record = {'time': datetime.now().isoformat(timespec='milliseconds'),
+                      'level': cls.NAMES[level],
+                      'message': message}
+            record.update(fields)
+            line = json.dumps(record, ensure_ascii=False, default=str)
+        else:
+            # Fields are only a part of machine readable output
+            line = cls.PREFIXES[level] + message
+            if cls.timestamps:
+                line = datetime.now().isoformat(sep=' ', timespec='milliseconds') + line
+
+        with cls._lock:
+            cls._buffer.append(line)
+            if len(cls._buffer) > cls.buffer_size:
+                cls._write_buffer()
+
+    @classmethod
+    def flush(cls):
+        """Writes buffered lines"""
+        with cls._lock:
+            cls._write_buffer()
+
+    @classmethod
+    def _write_buffer(cls):
+        if not cls._buffer:
+            return
+        stream = cls.stream if cls.stream is not None else sys.stdout
+        stream.write('\n'.join(cls._buffer) + '\n')
+        cls._buffer.clear()
+        if cls.buffer_size == 0:
+            stream.flush()
+
+
+atexit.register(Logger.flush)
+
+
+class WarningSummary:
+    """Groups repeated warnings of a stage by category"""
+    SAMPLE_COUNT: int = 3
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.counts: Dict[str, int] = dict()
+        self.samples: Dict[str, List[str]] = dict()
+        self._lock = threading.Lock()
+
+    def add(self, category: str, sample: str = ''):
+        """Counts the warning, prints it at once in verbose mode"""
+        if Logger.verbose:
+            Logger.warn(f'{category}: {sample}' if sample else category)
+            return
+        with self._lock:
+            count = self.counts.get(category, 0)
+            self.counts[category] = count + 1
+            if count < self.SAMPLE_COUNT and sample:
+                self.samples.setdefault(category, []).append(sample)
+
+    def emit(self):
+        """Prints one warning per category and forgets them"""
+        with self._lock:
+            counts, self.counts = self.counts, dict()
+            samples, self.samples = self.samples, dict()
+        for category, count in counts.items():
+            category_samples = samples.get(category, [])
+            message = f'{self.stage}: {category} ({count} times)'
+            if category_samples:
+                message += ', e.g. ' + '; '.join(category_samples)
+            Logger.warn(message, stage=self.stage, category=category,
+                        count=count, samples=category_samples)
+
+
+class Metrics:
+    """Collects per-stage timings and counters"""
+    timings: Dict[str, float] = dict()
+    calls: Dict[str, int] = dict()
+    counters: Dict[str, int] = dict()
+    # StageProfiler, profiles the timed blocks when set
+    profiler = None
+    _lock = threading.Lock()
+
+    @classmethod
+    @contextmanager
+    def timer(cls, stage: str):
+        """Adds the time spent in the block to the stage"""
+        profiler = cls.profiler
+        if profiler is not None:
+            profiler.enter(stage)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.add_time(stage, time.perf_counter() - started)
+            if profiler is not None:
+                profiler.exit(stage)
+
+    @classmethod
+    def timed_iter(cls, stage: str, iterable: Iterable, batch: int = 1) -> Iterator:
+        """
+        Yields items adding the time spent producing them to the stage\n
+        Items are produced batch at a time, so cheap items are not outweighed by timing
+        """
+        iterator = iter(iterable)
+        while True:
+            with cls.timer(stage):
+                items = list(islice(iterator, batch))
+            if not items:
+                return
+            yield from items
+
+    @classmethod
+    def add_time(cls, stage: str, seconds: float):
+        """Adds time to the stage"""
+        with cls._lock:
+            cls.timings[stage] = cls.timings.get(stage, 0.0) + seconds
+            cls.calls[stage] = cls.calls.get(stage, 0) + 1
+
+    @classmethod
+    def increment(cls, counter: str, value: int = 1):
+        """Increments the counter"""
+        with cls._lock:
+            cls.counters[counter] = cls.counters.get(counter, 0) + value
+
+    @classmethod
+    def reset(cls):
+        """Forgets collected metrics"""
+        with cls._lock:
+            cls.timings.clear()
+            cls.calls.clear()
+            cls.counters.clear()
+
+    @classmethod
+    def report(cls):
+        """Logs collected metrics"""
+        with cls._lock:
+            timings = dict(cls.timings)
+            calls = dict(cls.calls)
+            counters = dict(cls.counters)
+        for stage, seconds in timings.items():
+            Logger.info(f'Stage {stage}: {seconds:.3f}s in {calls[stage]} calls',
+                        stage=stage, seconds=round(seconds, 6), calls=calls[stage])
+        for counter, value in counters.items():
+            Logger.info(f'Counter {counter}: {value}', counter=counter, value=value)
@@ -6,6 +6,7 @@ from typing import List
 @dataclass
 class Todo:
     """Todo structure"""
+    __slots__ = ('user_id', 'id', 'title', 'completed')
     user_id: int
     id: int
     title: str
@@ -14,6 +15,7 @@ class Todo:
 @dataclass
 class User:
     """User structure"""
+    __slots__ = ('id', 'name', 'username', 'email', 'company_name', 'tasks')
     id: int
     name: str
     username: str
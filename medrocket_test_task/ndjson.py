@@ -0,0 +1,134 @@
+"""
+Newline-delimited JSON snapshots of the API feeds\n
+Usage: python -m medrocket_test_task.ndjson dump snapshot
+"""
+
+import argparse
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterable, Iterator, List
+
+from medrocket_test_task.deserializers import Deserializer
+from medrocket_test_task.logging import Logger
+from medrocket_test_task.providers import APITodoProvider, APIUserProvider, TodoProvider
+from medrocket_test_task.sharding import Shard
+from medrocket_test_task.transport import Transport
+
+USERS_FILE = 'users.ndjson'
+TODOS_FILE = 'todos.ndjson'
+
+
+class NDJSONError(ValueError):
+    """Should be raised when a snapshot line is not valid JSON"""
+
+
+def iter_ndjson(path: str) -> Iterator[Any]:
+    """
+    Yields records of the snapshot one line at a time\n
+    The file is memory-mapped, a line is decoded only when its record is requested
+    """
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if hasattr(data, 'madvise'):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+            start = 0
+            line_number = 0
+            while start < size:
+                end = data.find(b'\n', start)
+                if end == -1:
+                    end = size
+                line = data[start:end]
+                start = end + 1
+                line_number += 1
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    raise NDJSONError(f'{path}:{line_number}: {error}') from error
+                yield record
+
+
+class NDJSONTodoProvider(APITodoProvider):
+    """Provides todos from a memory-mapped NDJSON snapshot instead of API"""
+
+    def __init__(self, deserializer: Deserializer, path: str) -> None:
+        super().__init__(deserializer)
+        self.path = path
+
+    def _iter_all_records(self) -> Iterator[Dict]:
+        """Reads raw records from the snapshot file"""
+        return iter_ndjson(self.path)
+
+
+class NDJSONUserProvider(APIUserProvider):
+    """Provides users from a memory-mapped NDJSON snapshot instead of API"""
+
+    def __init__(self, deserializer: Deserializer, todo_provider: TodoProvider,
+                 path: str, concurrent: bool = True, columnar: bool = False,
+                 shard: Shard = None) -> None:
+        super().__init__(deserializer, todo_provider, concurrent=concurrent,
+                         columnar=columnar, shard=shard)
+        self.path = path
+
+    def _iter_records(self) -> Iterator[Dict]:
+        """Reads raw records from the snapshot file"""
+        return iter_ndjson(self.path)
+
+
+def write_ndjson(path: str, records: Iterable[Any]) -> int:
+    """Writes records a line each, the file is replaced only when complete"""
+    temp_path = path + '.tmp'
+    count = 0
+    with open(temp_path, 'w', encoding='utf-8', newline='\n') as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            file.write('\n')
+            count += 1
+    os.replace(temp_path, path)
+    return count
+
+
+def dump_feeds(directory: str, users_url: str, todos_url: str,
+               transport: Transport) -> List[int]:
+    """Streams raw users and todos into the directory, returns record counts"""
+    # pylint: disable=import-outside-toplevel
+    from medrocket_test_task.streaming import iter_json_array
+
+    os.makedirs(directory, exist_ok=True)
+    return [write_ndjson(os.path.join(directory, file_name),
+                         iter_json_array(transport.iter_chunks(url)))
+            for file_name, url in ((USERS_FILE, users_url), (TODOS_FILE, todos_url))]
+
+
+def main(args: List[str] = None):
+    """Dumps the live feeds into a snapshot directory"""
+    # pylint: disable=import-outside-toplevel
+    from medrocket_test_task.transport import RequestsTransport, UrllibTransport
+
+    parser = argparse.ArgumentParser(description='Manages NDJSON snapshots of the API')
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help='download users and todos into a directory')
+    dump.add_argument('directory')
+    dump.add_argument('--users-url', default=APIUserProvider.USERS_END_POINT)
+    dump.add_argument('--todos-url', default=APITodoProvider.TODO_END_POINT)
+    dump.add_argument('--transport', choices=['requests', 'urllib'], default='requests')
+    arguments = parser.parse_args(args)
+
+    transport_class = RequestsTransport if arguments.transport == 'requests' \
+        else UrllibTransport
+    transport = transport_class()
+    users, todos = dump_feeds(arguments.directory, arguments.users_url,
+                              arguments.todos_url, transport)
+    transport.close()
+    Logger.info(f'Dumped {users} users and {todos} todos to {arguments.directory}')
+    Logger.info('Transport: ' + transport.stats.summary())
+    Logger.flush()
+
+
+if __name__ == '__main__':
+    main()
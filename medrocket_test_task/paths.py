@@ -0,0 +1,128 @@
+"""
+Layout of the report directory\n
+Usage: python -m medrocket_test_task.paths migrate --levels 2
+"""
+
+import argparse
+import hashlib
+import os
+import re
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+from medrocket_test_task.index import ReportIndex, ReportIndexGroup
+from medrocket_test_task.logging import Logger
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M'
+OLD_REPORT = re.compile(
+    r'^old_(?P<username>.+)_(?P<date>\d{4}-\d{2}-\d{2}T\d{2}:\d{2})\.txt$')
+SHARD = re.compile(r'^[0-9a-f]{2}$')
+
+
+class ReportFile(NamedTuple):
+    """Current or archived report found in the directory"""
+    path: str
+    username: str
+    date: Optional[datetime]
+
+
+class ReportLayout:
+    """
+    Resolves paths of the reports, the writer and reading tools share it\n
+    With levels > 0 reports are spread over nested directories named by
+    the hash of the username, e.g. tasks/ab/cd/<username>.txt,
+    every level has up to 256 directories
+    """
+
+    def __init__(self, directory: str = 'tasks', levels: int = 0) -> None:
+        self.directory = directory
+        self.levels = levels
+
+    def shard(self, username: str) -> str:
+        """Returns the directory of the user's reports"""
+        if self.levels == 0:
+            return self.directory
+        digest = hashlib.sha256(username.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory,
+                            *(digest[2 * level:2 * level + 2] for level in range(self.levels)))
+
+    def report_path(self, username: str) -> str:
+        """Returns the path of the current report"""
+        return os.path.join(self.shard(username), username + '.txt')
+
+    def temp_path(self, username: str) -> str:
+        """Returns the path of the report being written"""
+        return os.path.join(self.shard(username), f'.{username}.txt.tmp')
+
+    def archive_path(self, username: str, date: datetime) -> str:
+        """Returns the path of the previous report generated at the date"""
+        return os.path.join(self.shard(username),
+                            f'old_{username}_{date.strftime(DATE_FORMAT)}.txt')
+
+    def iter_reports(self) -> Iterator[ReportFile]:
+        """Yields current and archived reports of any layout, archived ones have a date"""
+        if not os.path.isdir(self.directory):
+            return
+        for root, directories, files in os.walk(self.directory):
+            directories[:] = [name for name in directories if SHARD.match(name)]
+            for name in files:
+                if name.startswith('.') or not name.endswith('.txt'):
+                    continue
+                match = OLD_REPORT.match(name)
+                if match is None:
+                    yield ReportFile(os.path.join(root, name), name[:-len('.txt')], None)
+                else:
+                    yield ReportFile(os.path.join(root, name), match.group('username'),
+                                     datetime.strptime(match.group('date'), DATE_FORMAT))
+
+
+def migrate(source: ReportLayout, target: ReportLayout,
+            report_index: Union[ReportIndex, ReportIndexGroup] = None) -> int:
+    """Moves reports of the source layout into the target layout, returns count of moved files"""
+    # Listed first, new shard directories must not be walked again
+    reports: List[ReportFile] = list(source.iter_reports())
+    moved = 0
+    for report in reports:
+        if report.date is None:
+            path = target.report_path(report.username)
+        else:
+            path = target.archive_path(report.username, report.date)
+        if path == report.path:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(report.path, path)
+        if report_index is not None:
+            report_index.move(report.path, path)
+        moved += 1
+    for root, _, _ in os.walk(source.directory, topdown=False):
+        if root != source.directory and SHARD.match(os.path.basename(root)):
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+    return moved
+
+
+def main(args: List[str] = None):
+    """Converts the report directory between layouts"""
+    parser = argparse.ArgumentParser(description='Manages the report directory layout')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migration = commands.add_parser('migrate', help='move reports into another layout')
+    migration.add_argument('--directory', default='tasks')
+    migration.add_argument('--levels', type=int, required=True, metavar='N',
+                           help='directory levels of the new layout, 0 is flat')
+    arguments = parser.parse_args(args)
+
+    # Reports of every shard are moved, so every shard's index is updated
+    report_index = ReportIndexGroup(arguments.directory)
+    # Reports of any layout are found, so the source levels do not matter
+    moved = migrate(ReportLayout(arguments.directory),
+                    ReportLayout(arguments.directory, arguments.levels),
+                    report_index)
+    report_index.close()
+    Logger.info(f'Moved {moved} reports')
+    Logger.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Per-stage CPU and memory profiling"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+from typing import Dict, List, Tuple
+
+
+class StageFrame:
+    """Stage running on the current thread"""
+    __slots__ = ('stage', 'profile', 'started_memory', 'peak_memory')
+
+    def __init__(self, stage: str, profile: cProfile.Profile, started_memory: int) -> None:
+        self.stage = stage
+        self.profile = profile
+        self.started_memory = started_memory
+        self.peak_memory = started_memory
+
+
+class StageProfiler:
+    """
+    Profiles the stages timed by Metrics.timer: every thread keeps a stack of
+    its running stages and only the innermost one is profiled\n
+    Memory is traced for the whole process, so peaks are exact with a single worker
+    """
+
+    def __init__(self, directory: str, top: int = 30, frames: int = 5) -> None:
+        self.directory = directory
+        self.top = top
+        self.frames = frames
+        self.lock = threading.Lock()
+        self.profiles: List[Tuple[str, cProfile.Profile]] = []
+        self.memory: Dict[str, Dict[str, int]] = dict()
+        self._local = threading.local()
+        self._started_tracing = False
+
+    def start(self):
+        """Starts tracing memory allocations"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+    def enter(self, stage: str):
+        """Pauses the profile of the outer stage and starts the profile of the stage"""
+        stack = self._stack()
+        self._update_peaks(stack)
+        if stack:
+            stack[-1].profile.disable()
+        tracemalloc.reset_peak()
+        frame = StageFrame(stage, self._profile(stage), tracemalloc.get_traced_memory()[0])
+        stack.append(frame)
+        self._enable(frame.profile)
+
+    def exit(self, stage: str):
+        """Stops the profile of the stage and resumes the outer one"""
+        stack = self._stack()
+        for position in range(len(stack) - 1, -1, -1):
+            if stack[position].stage == stage:
+                break
+        else:
+            return
+        # Coroutines sharing a thread may leave their stages out of order
+        frame = stack.pop(position)
+        if position == len(stack):
+            frame.profile.disable()
+            if stack:
+                self._enable(stack[-1].profile)
+        self._update_peaks(stack + [frame])
+        with self.lock:
+            memory = self.memory.setdefault(stage, {'peak_bytes': 0, 'calls': 0})
+            memory['peak_bytes'] = max(memory['peak_bytes'],
+                                       frame.peak_memory - frame.started_memory)
+            memory['calls'] += 1
+
+    def dump(self):
+        """Writes <stage>.prof and <stage>.txt profiles, memory.json and allocations.txt"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            profiles = list(self.profiles)
+            memory = dict(self.memory)
+        by_stage: Dict[str, pstats.Stats] = dict()
+        for stage, profile in profiles:
+            profile.create_stats()
+            if stage in by_stage:
+                by_stage[stage].add(profile)
+            else:
+                by_stage[stage] = pstats.Stats(profile)
+        for stage, stats in by_stage.items():
+            stats.dump_stats(os.path.join(self.directory, stage + '.prof'))
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats('cumulative').print_stats(self.top)
+            report_path = os.path.join(self.directory, stage + '.txt')
+            with open(report_path, 'w', encoding='utf-8') as report:
+                report.write(text.getvalue())
+        with open(os.path.join(self.directory, 'memory.json'), 'w', encoding='utf-8') as report:
+            json.dump(memory, report, indent=2, sort_keys=True)
+        if tracemalloc.is_tracing():
+            statistics = tracemalloc.take_snapshot().statistics('lineno')
+            with open(os.path.join(self.directory, 'allocations.txt'), 'w',
+                      encoding='utf-8') as report:
+                for statistic in statistics[:self.top]:
+                    report.write(f'{statistic}\n')
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _stack(self) -> List[StageFrame]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            self._local.profiles = dict()
+        return stack
+
+    def _profile(self, stage: str) -> cProfile.Profile:
+        """Returns the profile of the stage on the current thread"""
+        profiles: Dict[str, cProfile.Profile] = self._local.profiles
+        profile = profiles.get(stage)
+        if profile is None:
+            profile = profiles[stage] = cProfile.Profile()
+            with self.lock:
+                self.profiles.append((stage, profile))
+        return profile
+
+    @staticmethod
+    def _enable(profile: cProfile.Profile):
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 profilers are process wide, the first thread wins
+            pass
+
+    @staticmethod
+    def _update_peaks(stack: List[StageFrame]):
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in stack:
+            frame.peak_memory = max(frame.peak_memory, peak)
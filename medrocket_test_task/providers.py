@@ -1,22 +1,42 @@
 """Classes providing data"""
 import abc
-import json
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List
 
-import requests
-
-from medrocket_test_task.deserializers import DeserializationError, Deserializer
-from medrocket_test_task.logging import Logger
+from medrocket_test_task.deserializers import DeserializationFailure, Deserializer, \
+    TodoDeserializer
+from medrocket_test_task.logging import Logger, Metrics, WarningSummary
 from medrocket_test_task.model import Todo, User
+from medrocket_test_task.sharding import Shard
+from medrocket_test_task.snapshots import BinarySnapshot, SnapshotError
+from medrocket_test_task.store import TodoStore
+from medrocket_test_task.streaming import iter_json_array
+from medrocket_test_task.transport import RequestsTransport, Transport
+
+
+def warn_invalid_records(stage: str, errors: List[DeserializationFailure]):
+    """Logs summary of records rejected by a deserializer"""
+    Metrics.increment('invalid_records', len(errors))
+    summary = WarningSummary(stage)
+    for error in errors:
+        summary.add('Invalid data accepted from the server: ' + error.message,
+                    repr(error.record)[:200])
+    summary.emit()
 
 
 class UserProvider(abc.ABC):
     """Abstract provider for users"""
+    # Users left out of the last fetch because their data failed to download
+    failed_users: int = 0
 
     @abc.abstractmethod
     def get_users(self):
         """Returns list of users"""
 
+    def iter_users(self) -> Iterator[User]:
+        """Yields users as soon as their todos are complete"""
+        return iter(self.get_users())
+
 
 class TodoProvider(abc.ABC):
     """Abstract provider for todos"""
@@ -25,6 +45,14 @@ class TodoProvider(abc.ABC):
     def get_todos(self):
         """Returns list of todos"""
 
+    def iter_todos(self) -> Iterator[Todo]:
+        """Yields todos one at a time"""
+        return iter(self.get_todos())
+
+    def fill_store(self, store: TodoStore):
+        """Appends todos to the columnar store"""
+        store.extend(self.iter_todos())
+
 
 class TestProvider(UserProvider):
     """Test Provider"""
@@ -36,55 +64,246 @@ class TestProvider(UserProvider):
         return self.users
 
 
+class SnapshotUserProvider(UserProvider):
+    """
+    Loads users from a binary snapshot, falls back to the wrapped provider
+    and snapshots its users when they were fetched without errors
+    """
+
+    def __init__(self, provider: UserProvider, snapshot: BinarySnapshot,
+                 columnar: bool = False) -> None:
+        self.provider = provider
+        self.snapshot = snapshot
+        self.columnar = columnar
+
+    def get_users(self):
+        return list(self.iter_users())
+
+    def iter_users(self) -> Iterator[User]:
+        try:
+            with Metrics.timer('snapshot_load'):
+                users = self.snapshot.load(self.columnar)
+        except SnapshotError as error:
+            Logger.info(f'Binary snapshot is not used: {error}')
+        else:
+            Logger.info(f'{len(users)} users are loaded from {self.snapshot.path}')
+            return iter(users)
+        return self._fetch_and_save()
+
+    def _fetch_and_save(self) -> Iterator[User]:
+        """Streams users of the wrapped provider, snapshots them once all are fetched"""
+        users = []
+        for user in self.provider.iter_users():
+            users.append(user)
+            yield user
+        self.failed_users = self.provider.failed_users
+        if self.failed_users:
+            Logger.warn('Binary snapshot is not saved, some data failed to download')
+            return
+        try:
+            with Metrics.timer('snapshot_save'):
+                self.snapshot.save(users)
+        except OSError as error:
+            Logger.warn(f'Failed to save binary snapshot: {error}')
+
+
 class APITodoProvider(TodoProvider):
     """Provides todos from API"""
     TODO_END_POINT: str = 'https://json.medrocket.ru/todos'
+    # Todos timed together by the deserialize stage
+    TIMED_BATCH: int = 1000
 
-    def __init__(self, deserializer: Deserializer) -> None:
+    def __init__(self, deserializer: Deserializer, transport: Transport = None) -> None:
+        if transport is None:
+            transport = RequestsTransport()
         self.deserializer = deserializer
+        self.transport = transport
 
     def get_todos(self):
-        data = requests.get(self.TODO_END_POINT)
-        data_dicts = json.loads(data.content)
-        todos = []
-        for data_dict in data_dicts:
-            if data_dict.get('userId') is not None:
-                data_dict['user_id'] = data_dict['userId']
-            try:
-                todo = self.deserializer.deserealize(**data_dict)
-                todos.append(todo)
-            except DeserializationError as error:
-                Logger.warn(
-                    'Invalid data accepted from the server: ' + str(error))
-        return todos
+        return list(self.iter_todos())
+
+    def iter_todos(self) -> Iterator[Todo]:
+        return self._deserialize(self._iter_all_records())
+
+    def fill_store(self, store: TodoStore):
+        records = self._iter_all_records()
+        if isinstance(self.deserializer, TodoDeserializer):
+            errors = []
+            with Metrics.timer('deserialize'):
+                self.deserializer.fill_store(records, store, errors)
+            warn_invalid_records('todos', errors)
+        else:
+            store.extend(self._deserialize(records))
+
+    def _deserialize(self, data_dicts: Iterable[Dict]) -> Iterator[Todo]:
+        errors = []
+        todos = self.deserializer.iter_many(data_dicts, errors)
+        yield from Metrics.timed_iter('deserialize', todos, self.TIMED_BATCH)
+        warn_invalid_records('todos', errors)
+
+    def _iter_all_records(self) -> Iterator[Dict]:
+        """Streams raw records of every todo"""
+        return self._iter_records(self.TODO_END_POINT)
+
+    def _iter_records(self, url: str) -> Iterator[Dict]:
+        """Streams raw records from the server"""
+        return iter_json_array(self.transport.iter_chunks(url))
+
+
+class APIUserTodoProvider(APITodoProvider):
+    """Provides todos from API, also filtered by a single user"""
+
+    def get_user_todos(self, user_id: int) -> List[Todo]:
+        """Returns todos of the user"""
+        url = f'{self.TODO_END_POINT}?userId={user_id}'
+        return list(self._deserialize(self._iter_records(url)))
 
 
 class APIUserProvider(UserProvider):
     """Provides users from API"""
     USERS_END_POINT: str = 'https://json.medrocket.ru/users'
 
-    def __init__(self, deserializer: Deserializer, todo_provider: TodoProvider) -> None:
+    def __init__(self, deserializer: Deserializer, todo_provider: TodoProvider,
+                 concurrent: bool = True, transport: Transport = None,
+                 columnar: bool = False, shard: Shard = None) -> None:
+        if transport is None:
+            transport = RequestsTransport()
         self.deserializer = deserializer
+        self.transport = transport
         self.todo_provider = todo_provider
+        self.concurrent = concurrent
+        self.columnar = columnar
+        self.shard = shard
 
     def get_users(self):
-        data = requests.get(self.USERS_END_POINT)
-        data_dicts = json.loads(data.content)
-        users = dict()
-        for data_dict in data_dicts:
-            try:
-                user: User = self.deserializer.deserealize(**data_dict)
-                users[user.id] = user
-            except DeserializationError as error:
-                Logger.warn(
-                    'Invalid data accepted from the server: ' + str(error))
-
-        todos: List[Todo] = self.todo_provider.get_todos()
-        for todo in todos:
-            user = users.get(todo.user_id)
-            if user is None:
-                Logger.warn('Received task without a user')
-            else:
-                user.tasks.append(todo)
+        if self.columnar:
+            fetch_todos, join = self._fetch_todo_store, self._join_store
+        else:
+            fetch_todos, join = self.todo_provider.iter_todos, self._join_todos
+
+        if not self.concurrent:
+            users = self._get_users_by_id()
+            return join(users, fetch_todos())
+
+        if not self.columnar:
+            fetch_todos = self._fetch_todos
+
+        def fetch_in_background():
+            # The worker thread has its own stage, so profiles cover the download
+            with Metrics.timer('fetch_todos'):
+                return fetch_todos()
+
+        # Todos are downloaded in the background while users are fetched
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            todos_future = executor.submit(fetch_in_background)
+            users = self._get_users_by_id()
+            todos = todos_future.result()
+        return join(users, todos)
+
+    def _get_users_by_id(self) -> Dict[int, User]:
+        # Records are streamed, so the stage includes reading and parsing them
+        with Metrics.timer('deserialize'):
+            result = self.deserializer.deserialize_many(self._iter_records())
+        warn_invalid_records('users', result.errors)
+        if self.shard is not None:
+            return {user.id: user for user in result.objects if self.shard.contains(user.id)}
+        return {user.id: user for user in result.objects}
+
+    def _is_orphan(self, user_id: int) -> bool:
+        """Checks if todos of the unknown user must be reported, other shards own theirs"""
+        return self.shard is None or self.shard.contains(user_id)
+
+    def _join_todos(self, users: Dict[int, User], todos: Iterable[Todo]) -> List[User]:
+        summary = WarningSummary('join')
+        with Metrics.timer('join'):
+            for todo in todos:
+                user = users.get(todo.user_id)
+                if user is None:
+                    if not self._is_orphan(todo.user_id):
+                        continue
+                    Metrics.increment('orphan_todos')
+                    summary.add('Received task without a user',
+                                f'todo {todo.id} of user {todo.user_id}')
+                else:
+                    user.tasks.append(todo)
+        summary.emit()
+
+        return list(users.values())
 
+    def _fetch_todos(self) -> List[Todo]:
+        """Downloads todos keeping only the shard's ones"""
+        if self.shard is None:
+            return self.todo_provider.get_todos()
+        return [todo for todo in self.todo_provider.iter_todos()
+                if self.shard.contains(todo.user_id)]
+
+    def _fetch_todo_store(self) -> TodoStore:
+        store = TodoStore()
+        self.todo_provider.fill_store(store)
+        return store
+
+    def _join_store(self, users: Dict[int, User], store: TodoStore) -> List[User]:
+        """Gives every user a view of its rows instead of Todo objects"""
+        summary = WarningSummary('join')
+        with Metrics.timer('join'):
+            for user in users.values():
+                user.tasks = store.view(user.id)
+            for user_id in store.user_ids_present():
+                if user_id not in users and self._is_orphan(user_id):
+                    for row in store.view(user_id).rows:
+                        Metrics.increment('orphan_todos')
+                        summary.add('Received task without a user',
+                                    f'todo {store.ids[row]} of user {user_id}')
+        summary.emit()
         return list(users.values())
+
+    def _iter_records(self) -> Iterator[Dict]:
+        """Streams raw records from the server"""
+        return iter_json_array(self.transport.iter_chunks(self.USERS_END_POINT))
+
+
+class APIFanOutUserProvider(APIUserProvider):
+    """Provides users from API fetching todos of every user in parallel"""
+
+    def __init__(self, deserializer: Deserializer, todo_provider: APIUserTodoProvider,
+                 max_workers: int = 8, transport: Transport = None,
+                 shard: Shard = None) -> None:
+        super().__init__(deserializer, todo_provider, transport=transport, shard=shard)
+        self.max_workers = max_workers
+
+    def get_users(self):
+        users = self._get_users_by_id()
+        completed = {user.id for user in self._iter_completed(users)}
+        return [user for user in users.values() if user.id in completed]
+
+    def iter_users(self) -> Iterator[User]:
+        return self._iter_completed(self._get_users_by_id())
+
+    def _iter_completed(self, users: Dict[int, User]) -> Iterator[User]:
+        """Fetches todos per user and yields users in completion order"""
+        self.failed_users = 0
+        summary = WarningSummary('join')
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.todo_provider.get_user_todos, user.id): user
+                for user in users.values()
+            }
+            for future in as_completed(futures):
+                user = futures[future]
+                try:
+                    todos = future.result()
+                except Exception as error:
+                    self.failed_users += 1
+                    Metrics.increment('fetch_errors')
+                    Logger.error(
+                        f'Failed to fetch tasks of {user.username}: {error}')
+                    continue
+                for todo in todos:
+                    if todo.user_id == user.id:
+                        user.tasks.append(todo)
+                    else:
+                        Metrics.increment('orphan_todos')
+                        summary.add('Received task without a user',
+                                    f'todo {todo.id} of user {todo.user_id}')
+                yield user
+        summary.emit()
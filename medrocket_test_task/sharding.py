@@ -0,0 +1,32 @@
+"""Deterministic split of users between runs"""
+
+import os
+import zlib
+from typing import NamedTuple
+
+
+class Shard(NamedTuple):
+    """Part of the users processed by one run, index is counted from 0"""
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, text: str) -> 'Shard':
+        """Parses 'i/N'"""
+        index, _, count = text.partition('/')
+        shard = cls(int(index), int(count))
+        if not 0 <= shard.index < shard.count:
+            raise ValueError(f'Shard {text} is out of range, expected i/N with 0 <= i < N')
+        return shard
+
+    def contains(self, user_id: int) -> bool:
+        """Checks if the user belongs to the shard, the hash is the same on every machine"""
+        return zlib.crc32(str(user_id).encode('ascii')) % self.count == self.index
+
+    def file_name(self, file_name: str) -> str:
+        """Returns the name of the shard's own copy of a state file"""
+        name, extension = os.path.splitext(file_name)
+        return f'{name}.shard-{self.index}-of-{self.count}{extension}'
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
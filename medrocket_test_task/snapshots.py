@@ -0,0 +1,194 @@
+"""Binary snapshots of validated users and todos"""
+
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from itertools import chain, repeat
+from typing import List, Sequence, Tuple
+
+from medrocket_test_task.model import Todo, User
+from medrocket_test_task.store import TodoStore
+
+# Completion flags of 8 rows for every bitmap byte
+_BITS: Tuple[Tuple[bool, ...], ...] = tuple(
+    tuple(bool(byte & (1 << bit)) for bit in range(8)) for byte in range(256))
+_SIZE = struct.Struct('<Q')
+
+
+class SnapshotError(ValueError):
+    """Should be raised when a snapshot is missing, stale or corrupt"""
+
+
+def _to_bytes(column: array) -> bytes:
+    """Returns little-endian bytes of the column"""
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _pack_strings(strings: Sequence[str]) -> List[bytes]:
+    """Returns character offsets and the UTF-8 text of the joined strings"""
+    offsets = array('q', [0])
+    total = 0
+    for string in strings:
+        total += len(string)
+        offsets.append(total)
+    text = ''.join(strings).encode('utf-8', 'surrogatepass')
+    return [_to_bytes(offsets), _SIZE.pack(len(text)), text]
+
+
+class BinarySnapshot:
+    """
+    Stores users with their joined todos in typed columns behind a versioned header,
+    a snapshot of another source, an older format, age or checksum is rejected
+    """
+    MAGIC: bytes = b'MRSNAP'
+    VERSION: int = 1
+    # magic, version, crc32 of the body, body size
+    HEADER = struct.Struct('<6sHIQ')
+    # created at, source length, user count, todo count
+    META = struct.Struct('<dIQQ')
+
+    def __init__(self, path: str, source: str = '', max_age: float = None) -> None:
+        self.path = path
+        self.source = source
+        self.max_age = max_age
+
+    def save(self, users: Sequence[User]) -> int:
+        """Writes the users and their todos, returns the snapshot size"""
+        todo_ids = array('q')
+        completed = bytearray()
+        titles = []
+        counts = array('q')
+        row = 0
+        for user in users:
+            count = 0
+            for todo in user.tasks:
+                if row % 8 == 0:
+                    completed.append(0)
+                if todo.completed:
+                    completed[row >> 3] |= 1 << (row & 7)
+                todo_ids.append(todo.id)
+                titles.append(todo.title)
+                row += 1
+                count += 1
+            counts.append(count)
+
+        source = self.source.encode('utf-8')
+        parts = [self.META.pack(time.time(), len(source), len(users), row), source,
+                 _to_bytes(array('q', (user.id for user in users))), _to_bytes(counts)]
+        for column in ([user.name for user in users], [user.username for user in users],
+                       [user.email for user in users], [user.company_name for user in users]):
+            parts.extend(_pack_strings(column))
+        parts.extend((_to_bytes(todo_ids), bytes(completed)))
+        parts.extend(_pack_strings(titles))
+
+        checksum = 0
+        size = 0
+        for part in parts:
+            checksum = zlib.crc32(part, checksum)
+            size += len(part)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, checksum, size))
+            file.writelines(parts)
+        os.replace(temp_path, self.path)
+        return self.HEADER.size + size
+
+    def load(self, columnar: bool = False) -> List[User]:
+        """
+        Returns the users with their todos, as TodoStore views when columnar\n
+        Raises SnapshotError if the snapshot can not be used
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError as error:
+            raise SnapshotError(f'{self.path} does not exist') from error
+        if len(data) < self.HEADER.size:
+            raise SnapshotError(f'{self.path} is truncated')
+        magic, version, checksum, size = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            raise SnapshotError(f'{self.path} is not a snapshot')
+        if version != self.VERSION:
+            raise SnapshotError(f'{self.path} has format version {version}, '
+                                f'expected {self.VERSION}')
+        body = memoryview(data)[self.HEADER.size:]
+        if len(body) != size or zlib.crc32(body) != checksum:
+            raise SnapshotError(f'{self.path} is corrupt')
+
+        reader = _ColumnReader(body)
+        created_at, source_size, user_count, todo_count = reader.unpack(self.META)
+        source = bytes(reader.take(source_size)).decode('utf-8')
+        if source != self.source:
+            raise SnapshotError(f'{self.path} is a snapshot of {source!r}')
+        if self.max_age is not None and time.time() - created_at > self.max_age:
+            raise SnapshotError(f'{self.path} is older than {self.max_age:.0f}s')
+
+        user_ids = reader.column(user_count)
+        counts = reader.column(user_count)
+        user_columns = [reader.strings(user_count) for _ in range(4)]
+        todo_ids = reader.column(todo_count)
+        completed = bytearray(reader.take((todo_count + 7) // 8))
+        titles = reader.strings(todo_count)
+
+        owners = array('q')
+        for user_id, count in zip(user_ids, counts):
+            owners.extend(array('q', (user_id,)) * count)
+        users = list(map(User, user_ids, *user_columns, repeat(None, user_count)))
+        if columnar:
+            store = TodoStore()
+            store.ids = todo_ids
+            store.user_ids = owners
+            store.completed = completed
+            store.titles = list(map(sys.intern, titles))
+            for user in users:
+                user.tasks = store.view(user.id)
+            return users
+
+        statuses = chain.from_iterable(map(_BITS.__getitem__, completed))
+        todos = list(map(Todo, owners, todo_ids, titles, statuses))
+        start = 0
+        for user, count in zip(users, counts):
+            user.tasks = todos[start:start + count]
+            start += count
+        return users
+
+
+class _ColumnReader:
+    """Reads snapshot parts in the order they were written"""
+
+    def __init__(self, body: memoryview) -> None:
+        self.body = body
+        self.position = 0
+
+    def take(self, size: int) -> memoryview:
+        """Returns the next size bytes"""
+        if self.position + size > len(self.body):
+            raise SnapshotError('Snapshot ends unexpectedly')
+        part = self.body[self.position:self.position + size]
+        self.position += size
+        return part
+
+    def unpack(self, layout: struct.Struct) -> tuple:
+        """Returns the next fixed size fields"""
+        return layout.unpack(self.take(layout.size))
+
+    def column(self, count: int) -> array:
+        """Returns the next column of 64-bit integers"""
+        column = array('q')
+        column.frombytes(self.take(count * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    def strings(self, count: int) -> List[str]:
+        """Returns the next string column"""
+        offsets = self.column(count + 1)
+        size, = self.unpack(_SIZE)
+        text = str(self.take(size), 'utf-8', 'surrogatepass')
+        return list(map(text.__getitem__, map(slice, offsets[:-1], offsets[1:])))
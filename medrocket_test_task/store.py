@@ -0,0 +1,100 @@
+"""Columnar todo storage"""
+
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, Tuple
+
+from medrocket_test_task.model import Todo
+
+
+class TodoStore:
+    """
+    Keeps todos in columns: ids and user ids in typed arrays,
+    completion as a bitmap and interned titles
+    """
+
+    def __init__(self) -> None:
+        self.ids = array('q')
+        self.user_ids = array('q')
+        self.completed = bytearray()
+        self.titles = []
+        self._rows_by_user: Dict[int, array] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, user_id: int, id: int, title: str, completed: bool):  # pylint: disable=redefined-builtin
+        """Appends todo fields as a new row"""
+        row = len(self.ids)
+        if row % 8 == 0:
+            self.completed.append(0)
+        if completed:
+            self.completed[row >> 3] |= 1 << (row & 7)
+        self.ids.append(id)
+        self.user_ids.append(user_id)
+        self.titles.append(sys.intern(title))
+        self._rows_by_user = None
+
+    def extend(self, todos: Iterable[Todo]):
+        """Appends todos"""
+        for todo in todos:
+            self.add(todo.user_id, todo.id, todo.title, todo.completed)
+
+    def is_completed(self, row: int) -> bool:
+        """Returns completion status of the row"""
+        return bool(self.completed[row >> 3] & (1 << (row & 7)))
+
+    def todo(self, row: int) -> Todo:
+        """Materializes the row"""
+        return Todo(self.user_ids[row], self.ids[row],
+                    self.titles[row], self.is_completed(row))
+
+    def user_ids_present(self) -> Iterable[int]:
+        """Returns ids of users having at least one todo"""
+        return self._index().keys()
+
+    def view(self, user_id: int) -> 'TodoView':
+        """Returns todos of the user"""
+        return TodoView(self, self._index().get(user_id, array('q')))
+
+    def _index(self) -> Dict[int, array]:
+        if self._rows_by_user is None:
+            rows_by_user = dict()
+            for row, user_id in enumerate(self.user_ids):
+                rows = rows_by_user.get(user_id)
+                if rows is None:
+                    rows = rows_by_user[user_id] = array('q')
+                rows.append(row)
+            self._rows_by_user = rows_by_user
+        return self._rows_by_user
+
+
+class TodoView:
+    """Read-only sequence of one user's todos stored in a TodoStore"""
+
+    def __init__(self, store: TodoStore, rows: array) -> None:
+        self.store = store
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Todo]:
+        return map(self.store.todo, self.rows)
+
+    def __getitem__(self, index: int) -> Todo:
+        return self.store.todo(self.rows[index])
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __reduce__(self):
+        # Only the user's own rows are sent to other processes
+        return (list, (list(self),))
+
+    def iter_title_status(self) -> Iterator[Tuple[str, bool]]:
+        """Yields (title, completed) pairs without creating Todo objects"""
+        titles = self.store.titles
+        completed = self.store.completed
+        for row in self.rows:
+            yield titles[row], bool(completed[row >> 3] & (1 << (row & 7)))
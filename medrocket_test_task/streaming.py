@@ -0,0 +1,81 @@
+"""Incremental JSON parsing"""
+
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+
+class StreamingJSONError(ValueError):
+    """Should be raised when the stream does not contain a JSON array"""
+
+
+def iter_json_array(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator[Any]:
+    """
+    Yields items of the top level JSON array one at a time\n
+    Only the unparsed tail of the stream is kept in memory, the stream is read
+    to its end so that wrappers of the chunks, such as the HTTP cache, see it complete
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+
+    def read_more() -> bool:
+        nonlocal buffer, position, exhausted
+        if exhausted:
+            return False
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            exhausted = True
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        return True
+
+    def next_char() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return ''
+
+    if next_char() != '[':
+        raise StreamingJSONError('Expected a JSON array')
+    position += 1
+
+    if next_char() != ']':
+        while True:
+            char = next_char()
+            if not char:
+                raise StreamingJSONError('Unexpected end of the stream')
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if read_more():
+                    continue
+                raise StreamingJSONError(str(error)) from error
+            if end == len(buffer) and not exhausted:
+                # A number may continue in the next chunk
+                read_more()
+                continue
+            position = end
+            yield item
+
+            char = next_char()
+            if char == ',':
+                position += 1
+            elif char == ']':
+                break
+            else:
+                raise StreamingJSONError('Expected "," or "]" between array items')
+
+    position += 1
+    if next_char():
+        raise StreamingJSONError('Unexpected data after the JSON array')
@@ -0,0 +1,204 @@
+"""HTTP transport classes"""
+
+import abc
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Mapping, Tuple
+
+
+class TransportError(IOError):
+    """Should be raised when the server returns an unusable response"""
+
+
+@dataclass
+class TransportStats:
+    """Transport counters"""
+    requests: int = 0
+    retries: int = 0
+    bytes_received: int = 0
+    latency: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add_request(self, retries: int, latency: float):
+        """Records finished request"""
+        with self.lock:
+            self.requests += 1
+            self.retries += retries
+            self.latency += latency
+
+    def add_bytes(self, count: int):
+        """Records received payload bytes"""
+        with self.lock:
+            self.bytes_received += count
+
+    def summary(self) -> str:
+        """Returns human readable counters"""
+        return (f'{self.requests} requests, {self.retries} retries, '
+                f'{self.bytes_received} bytes received, '
+                f'{self.latency:.3f}s total latency')
+
+
+@dataclass
+class TransportResponse:
+    """Response with a streamed body"""
+    status_code: int
+    headers: Mapping[str, str]
+    chunks: Iterator[bytes]
+
+
+class Transport(abc.ABC):
+    """Abstract HTTP transport"""
+
+    def __init__(self) -> None:
+        self.stats = TransportStats()
+
+    @abc.abstractmethod
+    def open(self, url: str, headers: Dict[str, str] = None):
+        """Returns context manager yielding TransportResponse"""
+
+    def iter_chunks(self, url: str) -> Iterator[bytes]:
+        """Yields response body of the url"""
+        with self.open(url) as response:
+            yield from response.chunks
+
+    def _count_bytes(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.stats.add_bytes(len(chunk))
+            yield chunk
+
+
+class RequestsTransport(Transport):
+    """Transport with a pooled keep-alive session, timeouts and retries"""
+    CHUNK_SIZE: int = 64 * 1024
+    RETRY_STATUSES: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def __init__(self, timeout: Tuple[float, float] = (5.0, 30.0), retries: int = 3,
+                 backoff_factor: float = 0.5, pool_size: int = 10) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Returns the session, requests is imported by the first request only"""
+        with self._lock:
+            if self._session is None:
+                # pylint: disable=import-outside-toplevel
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(total=self.retries,
+                              backoff_factor=self.backoff_factor,
+                              status_forcelist=self.RETRY_STATUSES,
+                              allowed_methods=frozenset(['GET']),
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                self._session = session
+            return self._session
+
+    @contextmanager
+    def open(self, url: str, headers: Dict[str, str] = None):
+        session = self.session
+        started = time.perf_counter()
+        try:
+            response = session.get(url, headers=headers, stream=True,
+                                   timeout=self.timeout)
+        except IOError as error:
+            # requests.RequestException is an IOError
+            raise TransportError(f'Request to {url} failed: {error}') from error
+        with response:
+            history = getattr(response.raw.retries, 'history', ())
+            self.stats.add_request(len(history), time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise TransportError(
+                    f'Server responded {response.status_code} to {url}')
+            chunks = response.iter_content(self.CHUNK_SIZE)
+            yield TransportResponse(response.status_code,
+                                    response.headers,
+                                    self._count_bytes(chunks))
+
+    def close(self):
+        """Closes pooled connections"""
+        if self._session is not None:
+            self._session.close()
+
+
+class UrllibTransport(Transport):
+    """
+    Standard library transport for simple GETs: a connection per request,
+    timeouts, retries and gzip, without importing requests
+    """
+    CHUNK_SIZE: int = 64 * 1024
+    RETRY_STATUSES: Tuple[int, ...] = RequestsTransport.RETRY_STATUSES
+
+    def __init__(self, timeout: float = 30.0, retries: int = 3,
+                 backoff_factor: float = 0.5) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+    @contextmanager
+    def open(self, url: str, headers: Dict[str, str] = None):
+        # pylint: disable=import-outside-toplevel
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+
+        request = Request(url, headers={'Accept-Encoding': 'gzip', **(headers or {})})
+        started = time.perf_counter()
+        retries = 0
+        while True:
+            try:
+                response = urlopen(request, timeout=self.timeout)
+                break
+            except HTTPError as error:
+                # Not modified and error statuses come as exceptions
+                if error.code < 400:
+                    response = error
+                    break
+                error.close()
+                if error.code not in self.RETRY_STATUSES or retries >= self.retries:
+                    self.stats.add_request(retries, time.perf_counter() - started)
+                    raise TransportError(f'Server responded {error.code} to {url}') from error
+            except OSError as error:
+                if retries >= self.retries:
+                    self.stats.add_request(retries, time.perf_counter() - started)
+                    raise TransportError(f'Request to {url} failed: {error}') from error
+            time.sleep(self.backoff_factor * 2 ** retries)
+            retries += 1
+
+        with response:
+            self.stats.add_request(retries, time.perf_counter() - started)
+            chunks = iter(lambda: response.read(self.CHUNK_SIZE), b'')
+            if response.headers.get('Content-Encoding') == 'gzip':
+                chunks = self._decompress(chunks)
+            yield TransportResponse(response.status, response.headers,
+                                    self._count_bytes(chunks))
+
+    @staticmethod
+    def _decompress(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        import zlib  # pylint: disable=import-outside-toplevel
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def close(self):
+        """Nothing to close, connections are not pooled"""
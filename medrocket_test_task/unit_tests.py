@@ -1,11 +1,44 @@
 """Module for unit-testing"""
+import asyncio
+import contextlib
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
 import unittest
+import unittest.mock
+import zipfile
 
+from medrocket_test_task.archive import ReportArchiver
+from medrocket_test_task.benchmarks import SyntheticDataset, iter_json_chunks, measure_import
 from medrocket_test_task.builders import DefaultUserBuilder
-from medrocket_test_task.deserializers import DeserializationError, TodoDeserializer, \
-    UserDeserializer
+from medrocket_test_task.bulk import SQLiteContainer, ZipContainer
+from medrocket_test_task.cache import CachingTransport, HTTPCache
+from medrocket_test_task.delta import UserFingerprints
+from medrocket_test_task.deserializers import DeserializationError, Deserializer, \
+    FieldDeserializer, TodoDeserializer, UserDeserializer
+from medrocket_test_task.index import ReportIndex, ReportIndexGroup
+from medrocket_test_task.logging import Logger, Metrics, WarningSummary
 from medrocket_test_task.model import Todo, User
+from medrocket_test_task.ndjson import NDJSONError, NDJSONTodoProvider, NDJSONUserProvider, \
+    dump_feeds, iter_ndjson, write_ndjson
+from medrocket_test_task.paths import ReportLayout, migrate
+from medrocket_test_task.profiling import StageProfiler
+from medrocket_test_task.providers import APIFanOutUserProvider, APITodoProvider, \
+    APIUserProvider, APIUserTodoProvider, SnapshotUserProvider, TodoProvider
+from medrocket_test_task.sharding import Shard
+from medrocket_test_task.snapshots import BinarySnapshot, SnapshotError
+from medrocket_test_task.store import TodoStore
+from medrocket_test_task.streaming import StreamingJSONError, iter_json_array
+from medrocket_test_task.transport import RequestsTransport, TransportError, UrllibTransport
+from medrocket_test_task.writers import FileSystemWriter, ReportManifest, SyncBatch, \
+    WriteResult, Writer
+from main import AppController, parse_args
 
 
 class BuilderTest(unittest.TestCase):
@@ -200,6 +233,44 @@ class BuilderTest(unittest.TestCase):
                                  'laborum aut in quam')
 
 
+    def test_builder_streams_the_same_document(self):
+        """Checks if chunked output equals the document, including titles with new lines"""
+        # arrange
+        titles = ['task', '', '\n', 'ends with new line\n', '\nstarts with new line',
+                  'x' * (DefaultUserBuilder.MAX_TASK_LENGTH + 5)]
+        date = datetime(2020, 9, 23, 15, 25)
+        for completed in ([], [True], [False], [True, False], [False, True, True]):
+            for title in titles:
+                tasks = [Todo(1, i, title, status) for i, status in enumerate(completed)]
+                tasks += [Todo(1, 9, title, True), Todo(1, 10, 'last', False)][:len(completed)]
+                user = User(1, 'Name Example', 'admin',
+                            'example@gmail.com', 'Company Example', tasks)
+                sut = DefaultUserBuilder(user, date)
+                sut.TITLES_PER_CHUNK = 2
+                # act
+                result = list(sut.iter_build())
+                # assert
+                self.assertEqual(''.join(result), reference_document(user, date))
+
+
+def reference_document(user, date):
+    """Builds the document the way the builder did before streaming"""
+    def trim(title):
+        if len(title) > DefaultUserBuilder.MAX_TASK_LENGTH:
+            return title[0:DefaultUserBuilder.MAX_TASK_LENGTH] + '...'
+        return title
+    completed = [trim(task.title) for task in user.tasks if task.completed]
+    rest = [trim(task.title) for task in user.tasks if not task.completed]
+    result = ''
+    if completed:
+        result += f'Завершённые задачи ({len(completed)}):\n' + '\n'.join(completed) + '\n\n'
+    if rest:
+        result += f'Оставшиеся задачи ({len(rest)}):\n' + '\n'.join(rest)
+    return (f'Отчёт для {user.company_name}.\n'
+            f'{user.name} <{user.email}> {date.strftime("%d.%m.%Y %H:%M")}\n'
+            f'Всего задач: {len(user.tasks)}\n\n' + result.strip('\n'))
+
+
 class TodoDeserializerTest(unittest.TestCase):
     """Tests TodoDeserializer class"""
 
@@ -215,6 +286,43 @@ class TodoDeserializerTest(unittest.TestCase):
         # assert
         self.assertEqual(result, task)
 
+    def test_deserializer_with_fields_requires_create(self):
+        """Checks if a deserializer without create can not be instantiated"""
+        # arrange
+        class IncompleteDeserializer(FieldDeserializer):  # pylint: disable=abstract-method
+            """Declares fields only"""
+            FIELDS = TodoDeserializer.FIELDS
+
+            def validate_data(self, **kwargs):
+                return kwargs
+
+            def deserealize(self, **kwargs):
+                return kwargs
+
+        # act and assert
+        self.assertRaises(TypeError, IncompleteDeserializer)
+
+    def test_deserializer_without_fields_falls_back_to_deserealize(self):
+        """Checks if a deserializer without FIELDS needs no create for batches"""
+        # arrange
+        class PlainDeserializer(Deserializer):
+            """Deserializes records with the old contract"""
+
+            def validate_data(self, **kwargs):
+                if 'id' not in kwargs:
+                    raise DeserializationError('Id is not specified')
+                return kwargs
+
+            def deserealize(self, **kwargs):
+                return self.validate_data(**kwargs)['id']
+
+        sut = PlainDeserializer()
+        # act
+        result = sut.deserialize_many([{'id': 1}, {}, {'id': 3}])
+        # assert
+        self.assertEqual(result.objects, [1, 3])
+        self.assertEqual([error.index for error in result.errors], [1])
+
     def test_deserializer_raises_the_exception_on_empty_dict(self):
         """Tests if deserializer raises the error on empty input"""
         # arrange
@@ -246,6 +354,28 @@ class TodoDeserializerTest(unittest.TestCase):
         self.assertRaises(DeserializationError, sut.deserealize, **task_dict)
 
 
+    def test_deserializer_returns_objects_and_failures_in_batch(self):
+        """Tests if batch deserialization keeps valid records and reports invalid ones"""
+        # arrange
+        records = [
+            {'id': 1, 'userId': 2, 'title': 'title', 'completed': True},
+            {'id': 'NaN', 'userId': 2, 'title': 'title', 'completed': True},
+            {'id': 2, 'user_id': 3, 'title': 'title', 'completed': False},
+            {'id': 3, 'userId': 2, 'title': 'title', 'completed': 'not bool'},
+            'not a record',
+        ]
+        sut = TodoDeserializer()
+        # act
+        result = sut.deserialize_many(records)
+        # assert
+        self.assertEqual(result.objects, [Todo(2, 1, 'title', True),
+                                          Todo(3, 2, 'title', False)])
+        self.assertEqual([(error.index, error.message) for error in result.errors],
+                         [(1, 'Id is not a number'),
+                          (3, 'Completed is not a bool'),
+                          (4, 'Record is not an object')])
+
+
 class UserDeserializerTest(unittest.TestCase):
     """Tests UserDeserializer class"""
 
@@ -357,3 +487,1265 @@ class UserDeserializerTest(unittest.TestCase):
             'email': 'example@gmail.com',
             'company': 'string'
         })
+
+    def test_deserializer_checks_nested_company_in_batch(self):
+        """Tests if batch deserialization validates the company like deserealize"""
+        # arrange
+        valid = user_record(1)
+        records = [valid, dict(valid, company='string'),
+                   dict(valid, company={'name': None})]
+        sut = UserDeserializer()
+        # act
+        result = sut.deserialize_many(records)
+        # assert
+        self.assertEqual(result.objects, [sut.deserealize(**valid)])
+        self.assertEqual([error.message for error in result.errors],
+                         ['Company is not specified', 'Company name is not specified'])
+
+
+class StaticTodoProvider(TodoProvider):
+    """Todo provider returning predefined todos"""
+
+    def __init__(self, todos):
+        self.todos = todos
+
+    def get_todos(self):
+        return list(self.todos)
+
+
+class StaticUserProvider(APIUserProvider):
+    """User provider reading predefined records instead of the server"""
+
+    def __init__(self, records, todo_provider, **kwargs):
+        super().__init__(UserDeserializer(), todo_provider, **kwargs)
+        self.records = records
+
+    def _iter_records(self):
+        return iter(self.records)
+
+
+def user_record(user_id):
+    """Returns valid raw user record"""
+    return {
+        'id': user_id,
+        'name': f'Name {user_id}',
+        'username': f'user{user_id}',
+        'email': f'user{user_id}@example.com',
+        'company': {'name': 'Company Example'}
+    }
+
+
+class APIUserProviderTest(unittest.TestCase):
+    """Tests APIUserProvider class"""
+
+    def test_provider_joins_todos_the_same_way_when_concurrent(self):
+        """Checks if concurrent fetching gives the same users as sequential one"""
+        # arrange
+        records = [user_record(1), user_record(2)]
+        todos = [Todo(1, 1, 'task1', True), Todo(2, 2, 'task2', False),
+                 Todo(3, 3, 'orphan', False), Todo(1, 4, 'task4', False)]
+        sequential = StaticUserProvider(
+            records, StaticTodoProvider(todos), concurrent=False)
+        sut = StaticUserProvider(records, StaticTodoProvider(todos))
+        # act
+        result = sut.get_users()
+        # assert
+        self.assertEqual(result, sequential.get_users())
+        self.assertEqual([len(user.tasks) for user in result], [2, 1])
+
+    def test_provider_joins_columnar_todos_the_same_way(self):
+        """Checks if columnar store gives the same users as Todo objects"""
+        # arrange
+        records = [user_record(1), user_record(2)]
+        todos = [Todo(1, 1, 'task1', True), Todo(2, 2, 'task2', False),
+                 Todo(3, 3, 'orphan', False), Todo(1, 4, 'task4', False)]
+        expected = StaticUserProvider(records, StaticTodoProvider(todos)).get_users()
+        sut = StaticUserProvider(records, StaticTodoProvider(todos), columnar=True)
+        # act
+        result = sut.get_users()
+        # assert
+        self.assertEqual(result, expected)
+
+
+    def test_shards_split_users_and_todos_without_orphan_warnings(self):
+        """Checks if shards together give the users of a single run and warn only of own orphans"""
+        # arrange
+        records = [user_record(i) for i in range(1, 21)]
+        todos = [Todo(i % 23, i, f'task{i}', i % 2 == 0) for i in range(200)]
+        expected = StaticUserProvider(records, StaticTodoProvider(todos)).get_users()
+        orphans = {todo.user_id for todo in todos if not 1 <= todo.user_id <= 20}
+        result = []
+        # act
+        for index in range(3):
+            for columnar in (False, True):
+                Metrics.reset()
+                shard = Shard(index, 3)
+                users = StaticUserProvider(records, StaticTodoProvider(todos),
+                                           columnar=columnar, shard=shard).get_users()
+                # assert
+                self.assertTrue(all(shard.contains(user.id) for user in users))
+                self.assertEqual(Metrics.counters.get('orphan_todos', 0),
+                                 sum(1 for todo in todos if todo.user_id in orphans
+                                     and shard.contains(todo.user_id)))
+            result.extend(users)
+        Metrics.reset()
+        self.assertEqual(sorted(result, key=lambda user: user.id), expected)
+        self.assertEqual(Shard.parse('2/3'), Shard(2, 3))
+        self.assertRaises(ValueError, Shard.parse, '3/3')
+
+
+class NDJSONSnapshotTest(unittest.TestCase):
+    """Tests NDJSON snapshot files and providers"""
+
+    def test_providers_read_the_same_users_as_api(self):
+        """Checks if snapshot providers join todos like the API provider"""
+        # arrange
+        records = [user_record(1), user_record(2), {'id': 'broken'}]
+        todos = [{'userId': 1, 'id': 1, 'title': 'Задача', 'completed': True},
+                 {'userId': 2, 'id': 2, 'title': 'task2', 'completed': False},
+                 {'userId': 1, 'id': 3, 'title': 'task3', 'completed': False}]
+        expected = StaticUserProvider(records, StaticTodoProvider(
+            TodoDeserializer().deserialize_many(todos).objects)).get_users()
+        with tempfile.TemporaryDirectory() as directory:
+            users_path = os.path.join(directory, 'users.ndjson')
+            todos_path = os.path.join(directory, 'todos.ndjson')
+            write_ndjson(users_path, records)
+            write_ndjson(todos_path, todos)
+            result = []
+            # act
+            for columnar in (False, True):
+                sut = NDJSONUserProvider(UserDeserializer(),
+                                         NDJSONTodoProvider(TodoDeserializer(), todos_path),
+                                         users_path, columnar=columnar)
+                result.append(sut.get_users())
+            Metrics.reset()
+        # assert
+        self.assertEqual(result, [expected, expected])
+
+    def test_reader_skips_blank_lines_and_reports_broken_ones(self):
+        """Checks if reader ignores empty lines and names the invalid line"""
+        # arrange
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.ndjson')
+            with open(path, 'wb') as file:
+                file.write(b'{"id": 1}\n\n[2]\r\n3')
+            empty_path = os.path.join(directory, 'empty.ndjson')
+            open(empty_path, 'wb').close()
+            broken_path = os.path.join(directory, 'broken.ndjson')
+            with open(broken_path, 'wb') as file:
+                file.write(b'1\n{\n')
+            # act
+            result = list(iter_ndjson(path))
+            # assert
+            self.assertEqual(result, [{'id': 1}, [2], 3])
+            self.assertEqual(list(iter_ndjson(empty_path)), [])
+            with self.assertRaisesRegex(NDJSONError, ':2:'):
+                list(iter_ndjson(broken_path))
+
+    def test_dump_writes_the_live_feeds(self):
+        """Checks if dumped snapshot holds the records served by the API"""
+        # arrange
+        users = [user_record(1)]
+        todos = [{'userId': 1, 'id': 1, 'title': 'task1', 'completed': True}]
+        routes = {'/users': (200, {}, json.dumps(users).encode()),
+                  '/todos': (200, {}, json.dumps(todos).encode())}
+        with tempfile.TemporaryDirectory() as directory, LocalServer(routes) as server:
+            # act
+            counts = dump_feeds(directory, server.url + '/users', server.url + '/todos',
+                                UrllibTransport())
+            # assert
+            self.assertEqual(counts, [1, 1])
+            self.assertEqual(list(iter_ndjson(os.path.join(directory, 'users.ndjson'))), users)
+            self.assertEqual(list(iter_ndjson(os.path.join(directory, 'todos.ndjson'))), todos)
+
+
+class BinarySnapshotTest(unittest.TestCase):
+    """Tests BinarySnapshot and SnapshotUserProvider classes"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'users.snapshot')
+        todos = [Todo(1, 1, 'Задача 😀', True), Todo(2, 2, '', False),
+                 Todo(1, 3, 'task3', False)] + \
+                [Todo(1, i, f'task{i}', i % 3 == 0) for i in range(4, 20)]
+        self.users = StaticUserProvider([user_record(1), user_record(2), user_record(3)],
+                                        StaticTodoProvider(todos)).get_users()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_loads_the_saved_users(self):
+        """Checks if loaded users equal the saved ones in both todo layouts"""
+        # arrange
+        sut = BinarySnapshot(self.path, 'source')
+        sut.save(self.users)
+        # act
+        result = sut.load()
+        columnar = sut.load(columnar=True)
+        # assert
+        self.assertEqual(result, self.users)
+        self.assertEqual(columnar, self.users)
+        self.assertEqual([len(user.tasks) for user in result], [18, 1, 0])
+
+    def test_snapshot_rejects_stale_and_corrupt_files(self):
+        """Checks if snapshot of another source, version, age or content is rejected"""
+        # arrange
+        BinarySnapshot(self.path, 'source').save(self.users)
+        with open(self.path, 'rb') as file:
+            data = bytearray(file.read())
+        # act and assert
+        self.assertRaisesRegex(SnapshotError, 'snapshot of', BinarySnapshot(
+            self.path, 'other').load)
+        self.assertRaisesRegex(SnapshotError, 'older', BinarySnapshot(
+            self.path, 'source', max_age=-1).load)
+        self.assertRaisesRegex(SnapshotError, 'does not exist', BinarySnapshot(
+            self.path + '.missing', 'source').load)
+        for offset in (6, len(data) - 1):
+            broken = bytearray(data)
+            broken[offset] ^= 0xff
+            with open(self.path, 'wb') as file:
+                file.write(broken)
+            self.assertRaises(SnapshotError, BinarySnapshot(self.path, 'source').load)
+
+    def test_provider_fetches_once_and_then_loads_the_snapshot(self):
+        """Checks if wrapped provider is used only while there is no snapshot"""
+        # arrange
+        class CountingProvider(StaticUserProvider):
+            """Counts fetches"""
+            calls = 0
+
+            def get_users(self):
+                CountingProvider.calls += 1
+                return super().get_users()
+
+        sut = SnapshotUserProvider(
+            CountingProvider([user_record(1)], StaticTodoProvider([Todo(1, 1, 'task1', True)])),
+            BinarySnapshot(self.path, 'source'))
+        # act
+        first = sut.get_users()
+        second = sut.get_users()
+        Metrics.reset()
+        # assert
+        self.assertEqual(CountingProvider.calls, 1)
+        self.assertEqual(second, first)
+        self.assertEqual(len(second[0].tasks), 1)
+
+    def test_provider_returns_users_when_the_snapshot_can_not_be_saved(self):
+        """Checks if a failed snapshot write does not lose the fetched users"""
+        # arrange
+        path = os.path.join(self.directory.name, 'missing', 'users.snapshot')
+        provider = StaticUserProvider([user_record(1)], StaticTodoProvider([]))
+        sut = SnapshotUserProvider(provider, BinarySnapshot(path, 'source'))
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = sut.get_users()
+        Metrics.reset()
+        # assert
+        self.assertEqual([user.id for user in result], [1])
+
+
+    def test_provider_streams_users_and_skips_the_snapshot_after_failures(self):
+        """Checks if users are streamed from the wrapped provider and partial data is not saved"""
+        # arrange
+        class FailingProvider(StaticUserProvider):
+            """Streams users and reports a user whose todos failed"""
+
+            def get_users(self):
+                raise AssertionError('users must be streamed')
+
+            def iter_users(self):
+                self.failed_users = 1
+                return iter(super().get_users())
+
+        sut = SnapshotUserProvider(
+            FailingProvider([user_record(1)], StaticTodoProvider([])),
+            BinarySnapshot(self.path, 'source'))
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = list(sut.iter_users())
+        # assert
+        self.assertEqual([user.id for user in result], [1])
+        self.assertEqual(sut.failed_users, 1)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class StreamingJSONTest(unittest.TestCase):
+    """Tests iter_json_array function"""
+
+    def test_parser_yields_items_split_across_chunks(self):
+        """Checks if parser yields the same items regardless of chunk boundaries"""
+        # arrange
+        items = [{'id': 1, 'title': 'Отчёт'}, 12345, 'text', [1, 2], None]
+        payload = json.dumps(items, ensure_ascii=False).encode('utf-8')
+        for size in (1, 2, 3, 7, len(payload)):
+            chunks = [payload[i:i + size] for i in range(0, len(payload), size)]
+            # act
+            result = list(iter_json_array(chunks))
+            # assert
+            self.assertEqual(result, items)
+
+    def test_parser_returns_nothing_on_empty_array(self):
+        """Checks if parser yields nothing for an empty array"""
+        self.assertEqual(list(iter_json_array([b' [ ', b' ] '])), [])
+
+    def test_parser_raises_the_exception_on_invalid_input(self):
+        """Checks if parser raises the error on data that is not an array"""
+        self.assertRaises(StreamingJSONError, list, iter_json_array([b'{}']))
+        self.assertRaises(StreamingJSONError, list, iter_json_array([b'[1, 2']))
+        self.assertRaises(StreamingJSONError, list, iter_json_array([b'[1 2]']))
+        self.assertRaises(StreamingJSONError, list, iter_json_array([b'[1]', b' [2]']))
+
+
+class LocalServer:
+    """HTTP server answering with predefined routes on a background thread"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serves routes of the enclosing server"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Answers GET request"""
+                server.requests.append((self.path, dict(self.headers)))
+                status, headers, body = server.routes.get(
+                    self.path, (404, {}, b''))
+                if 'ETag' in headers and self.headers.get('If-None-Match') == headers['ETag']:
+                    status, body = 304, b''
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Keeps test output clean"""
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RequestsTransportTest(unittest.TestCase):
+    """Tests RequestsTransport class"""
+
+    def test_transport_counts_received_bytes(self):
+        """Checks if transport returns the body and counts it"""
+        # arrange
+        with LocalServer({'/data': (200, {}, b'[1, 2, 3]')}) as server:
+            sut = RequestsTransport()
+            # act
+            result = b''.join(sut.iter_chunks(server.url + '/data'))
+        # assert
+        self.assertEqual(result, b'[1, 2, 3]')
+        self.assertEqual(sut.stats.requests, 1)
+        self.assertEqual(sut.stats.bytes_received, len(result))
+
+    def test_transport_raises_the_exception_on_error_status(self):
+        """Checks if transport raises the error when the server fails"""
+        # arrange
+        with LocalServer({}) as server:
+            sut = RequestsTransport(retries=0)
+            # act and assert
+            self.assertRaises(TransportError, list,
+                              sut.iter_chunks(server.url + '/missing'))
+
+
+class UrllibTransportTest(unittest.TestCase):
+    """Tests UrllibTransport class"""
+
+    def test_transport_decompresses_the_body(self):
+        """Checks if transport returns the decompressed body and counts it"""
+        # arrange
+        body = gzip.compress(b'[1, 2, 3]')
+        with LocalServer({'/data': (200, {'Content-Encoding': 'gzip'}, body)}) as server:
+            sut = UrllibTransport()
+            # act
+            result = b''.join(sut.iter_chunks(server.url + '/data'))
+        # assert
+        self.assertEqual(result, b'[1, 2, 3]')
+        self.assertEqual(sut.stats.requests, 1)
+
+    def test_transport_returns_not_modified_response(self):
+        """Checks if conditional requests get 304 instead of an error"""
+        # arrange
+        routes = {'/data': (200, {'ETag': '"v1"'}, b'[1]')}
+        with LocalServer(routes) as server:
+            sut = UrllibTransport()
+            # act
+            with sut.open(server.url + '/data', {'If-None-Match': '"v1"'}) as response:
+                status = response.status_code
+        # assert
+        self.assertEqual(status, 304)
+
+    def test_transport_raises_the_exception_on_error_status(self):
+        """Checks if transport raises the error when the server fails"""
+        # arrange
+        with LocalServer({}) as server:
+            sut = UrllibTransport(retries=0)
+            # act and assert
+            self.assertRaises(TransportError, list,
+                              sut.iter_chunks(server.url + '/missing'))
+
+
+class ColdStartTest(unittest.TestCase):
+    """Tests import cost of the script"""
+
+    def test_script_does_not_import_lazy_modules(self):
+        """Checks if importing main leaves network, pipeline and profiling modules unloaded"""
+        # act
+        _, loaded = measure_import(repeat=1)
+        # assert
+        self.assertEqual(loaded, [])
+
+
+class APIFanOutUserProviderTest(unittest.TestCase):
+    """Tests APIFanOutUserProvider class"""
+
+    def test_provider_fetches_todos_of_every_user(self):
+        """Checks if provider joins per user todos and keeps the user order"""
+        # arrange
+        def todos(user_id, count):
+            body = json.dumps([{'userId': user_id, 'id': user_id * 10 + i,
+                                'title': f'task{i}', 'completed': i % 2 == 0}
+                               for i in range(count)])
+            return (200, {}, body.encode('utf-8'))
+        routes = {
+            '/users': (200, {}, json.dumps([user_record(1), user_record(2)]).encode()),
+            '/todos?userId=1': todos(1, 3),
+            '/todos?userId=2': todos(2, 1),
+        }
+        with LocalServer(routes) as server:
+            transport = RequestsTransport()
+            todo_provider = APIUserTodoProvider(TodoDeserializer(), transport)
+            todo_provider.TODO_END_POINT = server.url + '/todos'
+            sut = APIFanOutUserProvider(UserDeserializer(), todo_provider,
+                                        max_workers=2, transport=transport)
+            sut.USERS_END_POINT = server.url + '/users'
+            # act
+            result = sut.get_users()
+        # assert
+        self.assertEqual([user.id for user in result], [1, 2])
+        self.assertEqual([len(user.tasks) for user in result], [3, 1])
+        self.assertEqual(transport.stats.requests, 3)
+
+
+class CachingTransportTest(unittest.TestCase):
+    """Tests CachingTransport and HTTPCache classes"""
+
+    def test_transport_reuses_the_body_on_not_modified(self):
+        """Checks if the second request is conditional and served from the cache"""
+        # arrange
+        routes = {'/data': (200, {'ETag': '"v1"'}, b'[1, 2, 3]')}
+        with tempfile.TemporaryDirectory() as directory, LocalServer(routes) as server:
+            cache = HTTPCache(directory)
+            sut = CachingTransport(RequestsTransport(), cache)
+            # act
+            first = b''.join(sut.iter_chunks(server.url + '/data'))
+            second = b''.join(sut.iter_chunks(server.url + '/data'))
+        # assert
+        self.assertEqual(first, b'[1, 2, 3]')
+        self.assertEqual(second, first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(server.requests[1][1].get('If-None-Match'), '"v1"')
+
+    def test_providers_revalidate_the_cached_feeds(self):
+        """Checks if bodies parsed by providers are stored and reused by the next run"""
+        # arrange
+        todos = [{'userId': 1, 'id': 1, 'title': 'task', 'completed': True}]
+        routes = {
+            '/users': (200, {'ETag': '"u1"'}, json.dumps([user_record(1)]).encode()),
+            '/todos': (200, {'ETag': '"t1"'}, json.dumps(todos).encode()),
+        }
+        with tempfile.TemporaryDirectory() as directory, LocalServer(routes) as server:
+            cache = HTTPCache(directory)
+            transport = CachingTransport(RequestsTransport(), cache)
+            todo_provider = APITodoProvider(TodoDeserializer(), transport)
+            todo_provider.TODO_END_POINT = server.url + '/todos'
+            sut = APIUserProvider(UserDeserializer(), todo_provider, transport=transport)
+            sut.USERS_END_POINT = server.url + '/users'
+            # act
+            first = sut.get_users()
+            second = sut.get_users()
+        # assert
+        self.assertEqual(second, first)
+        self.assertEqual([len(user.tasks) for user in second], [1])
+        self.assertEqual((cache.hits, cache.misses, len(cache.entries)), (2, 2, 2))
+        self.assertEqual(sorted(headers.get('If-None-Match') for _, headers in server.requests[2:]),
+                         ['"t1"', '"u1"'])
+
+    def test_cache_evicts_least_recently_used_entries(self):
+        """Checks if cache stays within its size limit"""
+        # arrange
+        with tempfile.TemporaryDirectory() as directory:
+            sut = HTTPCache(directory, max_size=10)
+            # act
+            list(sut.store('first', {'ETag': '1'}, iter([b'123456'])))
+            list(sut.store('second', {'ETag': '2'}, iter([b'123456'])))
+            sut.save()
+            # assert
+            self.assertIsNone(sut.get('first'))
+            self.assertIsNotNone(sut.get('second'))
+            self.assertIsNotNone(HTTPCache(directory).get('second'))
+
+    def test_cache_writes_the_index_only_on_save(self):
+        """Checks if hits and stores are kept in memory until the index is saved"""
+        # arrange
+        with tempfile.TemporaryDirectory() as directory:
+            sut = HTTPCache(directory)
+            # act
+            list(sut.store('first', {'ETag': '1'}, iter([b'123'])))
+            list(sut.read('first'))
+            unsaved = os.listdir(directory)
+            sut.save()
+            # assert
+            self.assertNotIn(HTTPCache.INDEX_FILE, unsaved)
+            self.assertEqual(HTTPCache(directory).get('first').size, 3)
+            self.assertEqual((sut.hits, sut.size), (1, 3))
+
+
+class FileSystemWriterTest(unittest.TestCase):
+    """Tests FileSystemWriter class"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.user = User(1, 'Name Example', 'admin',
+                         'example@gmail.com', 'Company Example',
+                         [Todo(1, 1, 'task1', True)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, date, manifest=None, stream=False, **options):
+        """Builds and writes the report of the user"""
+        builder = DefaultUserBuilder(self.user, date)
+        document = builder.iter_build() if stream else builder.build()
+        sut = FileSystemWriter(self.user, manifest, **options)
+        sut.TASK_DIRECTORY = self.directory.name
+        return sut.write(document)
+
+    def test_writer_streams_chunks_and_skips_unchanged_report(self):
+        """Checks if chunked reports are written whole and hashed like strings"""
+        # arrange
+        manifest = ReportManifest(self.directory.name)
+        date = datetime(2020, 9, 23, 15, 25)
+        self.write(date, manifest, stream=True)
+        # act
+        result = self.write(datetime(2020, 9, 24, 15, 25), manifest, stream=True)
+        # assert
+        self.assertFalse(result)
+        self.assertEqual(os.listdir(self.directory.name), ['admin.txt'])
+        with open(os.path.join(self.directory.name, 'admin.txt'), encoding='utf-8') as report:
+            self.assertEqual(report.read(), DefaultUserBuilder(self.user, date).build())
+
+    def test_writer_takes_archive_date_from_report_index(self):
+        """Checks if writer records reports in the index and does not parse the old report"""
+        # arrange
+        index = ReportIndex(self.directory.name)
+        first, second = datetime(2020, 9, 23, 15, 25), datetime(2020, 9, 24, 15, 25)
+        self.write(first, generated_at=first, report_index=index)
+        report_path = os.path.join(self.directory.name, 'admin.txt')
+        with open(report_path, 'w', encoding='utf-8') as report:
+            report.write('no date here')
+        # act
+        self.write(second, generated_at=second, report_index=index)
+        index.close()
+        # assert
+        archive_path = os.path.join(self.directory.name, 'old_admin_2020-09-23T15:25.txt')
+        self.assertTrue(os.path.exists(archive_path))
+        versions = ReportIndex(self.directory.name).versions('admin')
+        self.assertEqual([(record.path, record.generated_at, record.current)
+                          for record in versions],
+                         [(archive_path, first, False), (report_path, second, True)])
+        self.assertEqual(versions[1].size, os.path.getsize(report_path))
+
+    def test_writer_uses_sharded_layout_and_migration_flattens_it(self):
+        """Checks if sharded reports are found and moved back into the flat layout"""
+        # arrange
+        layout = ReportLayout(self.directory.name, levels=2)
+        self.write(datetime(2020, 9, 23, 15, 25), layout=layout)
+        self.user.tasks.append(Todo(1, 2, 'task2', False))
+        self.write(datetime(2020, 9, 24, 15, 25), layout=layout)
+        shard = layout.shard('admin')
+        sharded = sorted(os.listdir(shard))
+        # act
+        result = migrate(layout, ReportLayout(self.directory.name))
+        # assert
+        self.assertEqual(os.path.relpath(shard, self.directory.name).count(os.sep), 1)
+        self.assertEqual(sharded, ['admin.txt', 'old_admin_2020-09-23T15:25.txt'])
+        self.assertEqual(result, 2)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), sharded)
+
+    def test_writer_publishes_batched_reports_on_flush(self):
+        """Checks if batched reports replace the current ones only after flush"""
+        # arrange
+        batch = SyncBatch(size=10)
+        self.write(datetime(2020, 9, 23, 15, 25))
+        self.user.tasks.append(Todo(1, 2, 'task2', False))
+        self.write(datetime(2020, 9, 24, 15, 25), sync_batch=batch)
+        report_path = os.path.join(self.directory.name, 'admin.txt')
+        with open(report_path, encoding='utf-8') as report:
+            before = report.read()
+        # act
+        batch.flush()
+        # assert
+        with open(report_path, encoding='utf-8') as report:
+            after = report.read()
+        self.assertIn('23.09.2020', before)
+        self.assertIn('24.09.2020', after)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['admin.txt', 'old_admin_2020-09-23T15:25.txt'])
+
+    def test_sync_batch_publishes_the_rest_when_a_report_fails(self):
+        """Checks if a report failing to sync is discarded and the others are published"""
+        # arrange
+        published = []
+        batch = SyncBatch(size=10, on_published=published.append)
+        results = []
+        for username in ('first', 'second'):
+            user = User(1, 'Name Example', username, 'example@gmail.com', 'Company Example', [])
+            sut = FileSystemWriter(user, sync_batch=batch,
+                                   layout=ReportLayout(self.directory.name))
+            results.append(sut.write('report of ' + username))
+        os.remove(batch.pending[0][1])
+        # act
+        batch.flush()
+        # assert
+        self.assertEqual(results, [WriteResult.SCHEDULED, WriteResult.SCHEDULED])
+        self.assertEqual([user.username for user in published], ['second'])
+        self.assertEqual(batch.published, 1)
+        self.assertEqual(os.listdir(self.directory.name), ['second.txt'])
+
+    def test_writer_skips_unchanged_report(self):
+        """Checks if writer does not touch the report when only its date changed"""
+        # arrange
+        manifest = ReportManifest(self.directory.name)
+        self.write(datetime(2020, 9, 23, 15, 25), manifest)
+        manifest.save()
+        manifest = ReportManifest(self.directory.name)
+        # act
+        result = self.write(datetime(2020, 9, 24, 15, 25), manifest)
+        # assert
+        self.assertFalse(result)
+        self.assertEqual(manifest.skipped, 1)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['.manifest.json', 'admin.txt'])
+
+    def test_writer_archives_changed_report(self):
+        """Checks if writer keeps the previous version of a changed report"""
+        # arrange
+        manifest = ReportManifest(self.directory.name)
+        self.write(datetime(2020, 9, 23, 15, 25), manifest)
+        self.user.tasks.append(Todo(1, 2, 'task2', False))
+        # act
+        result = self.write(datetime(2020, 9, 24, 15, 25), manifest)
+        # assert
+        self.assertTrue(result)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['admin.txt', 'old_admin_2020-09-23T15:25.txt'])
+
+
+class ReportIndexTest(unittest.TestCase):
+    """Tests ReportIndex class"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_report_index_commits_in_batches(self):
+        """Checks if published rows reach the database before the index is closed"""
+        # arrange
+        index = ReportIndex(self.directory.name)
+        index.COMMIT_EVERY = 2
+        date = datetime(2020, 9, 23, 15, 25)
+        # act
+        for i in range(3):
+            index.publish(f'user{i}', f'user{i}.txt', date, None, 1)
+        # assert
+        reader = ReportIndex(self.directory.name)
+        self.assertIsNotNone(reader.current('user1'))
+        self.assertIsNone(reader.current('user2'))
+        reader.close()
+        index.close()
+
+    def test_locked_index_is_kept(self):
+        """Checks if an index locked by another run raises the error and keeps its rows"""
+        # arrange
+        writer = ReportIndex(self.directory.name)
+        writer.publish('admin', 'admin.txt', datetime(2020, 9, 23, 15, 25), None, 1)
+        writer.close()
+        blocker = sqlite3.connect(writer.path)
+        blocker.execute('BEGIN EXCLUSIVE')
+        sut = ReportIndex(self.directory.name)
+        sut.BUSY_TIMEOUT = 0.01
+        # act and assert
+        self.assertRaises(sqlite3.OperationalError, sut.publish, 'other', 'other.txt',
+                          datetime(2020, 9, 24, 15, 25), None, 1)
+        blocker.rollback()
+        blocker.close()
+        self.assertIsNotNone(ReportIndex(self.directory.name).current('admin'))
+
+    def test_corrupt_index_is_recreated(self):
+        """Checks if a file that is not a database is replaced by an empty index"""
+        # arrange
+        sut = ReportIndex(self.directory.name)
+        with open(sut.path, 'wb') as file:
+            file.write(b'not a database' * 100)
+        # act
+        sut.publish('admin', 'admin.txt', datetime(2020, 9, 23, 15, 25), None, 1)
+        sut.close()
+        # assert
+        self.assertIsNotNone(ReportIndex(self.directory.name).current('admin'))
+
+
+class MemoryWriter(Writer):
+    """Writer keeping documents in memory, fails on users named 'broken'"""
+    documents = {}
+
+    def __init__(self, user, manifest=None, **options):
+        self.user = user
+
+    def write(self, data):
+        if self.user.username.startswith('broken'):
+            raise IOError(f'Failed to write {self.user.username}')
+        self.documents[self.user.username] = data
+        return True
+
+
+class AppControllerTest(unittest.TestCase):
+    """Tests AppController class"""
+
+    def run_controller(self, users, **kwargs):
+        """Runs controller on the users and returns logged errors"""
+        with tempfile.TemporaryDirectory() as directory:
+            sut = AppController(**kwargs)
+            sut.writer_class = MemoryWriter
+            sut.manifest = ReportManifest(directory)
+            MemoryWriter.documents = {}
+            if sut.pipeline:
+                return asyncio.run(sut._run_pipeline(users))
+            return sut._run_parallel(users) if sut.workers > 1 \
+                else sut._run_sequential(users)
+
+    def test_parallel_run_gives_the_same_result_as_sequential(self):
+        """Checks if parallel run writes the same documents and reports errors in order"""
+        # arrange
+        users = [User(i, f'Name {i}', f'broken{i}' if i % 3 == 0 else f'user{i}',
+                      'example@gmail.com', 'Company Example',
+                      [Todo(i, i, f'task{i}', i % 2 == 0)])
+                 for i in range(20)]
+        expected = self.run_controller(users)
+        expected_documents = dict(MemoryWriter.documents)
+        # act
+        result = self.run_controller(users, workers=4)
+        # assert
+        self.assertEqual(result, expected)
+        self.assertEqual(result[0], 13)
+        self.assertEqual(result[1][0], 'Failed to write broken0')
+        self.assertEqual(MemoryWriter.documents.keys(), expected_documents.keys())
+
+    def test_pipeline_run_gives_the_same_result_as_sequential(self):
+        """Checks if pipelined run writes the same documents and reports errors in order"""
+        # arrange
+        users = [User(i, f'Name {i}', f'broken{i}' if i % 3 == 0 else f'user{i}',
+                      'example@gmail.com', 'Company Example',
+                      [Todo(i, i, f'task{i}', i % 2 == 0)])
+                 for i in range(50)]
+        expected = self.run_controller(users)
+        expected_documents = dict(MemoryWriter.documents)
+        # act
+        result = self.run_controller(users, workers=3, pipeline=True)
+        # assert
+        self.assertEqual(result, expected)
+        self.assertEqual(MemoryWriter.documents.keys(), expected_documents.keys())
+
+    def test_shards_keep_their_own_index_and_container(self):
+        """Checks if shards sharing the report directory do not share state files"""
+        # act
+        first = AppController(shard=Shard(0, 2), output='zip')
+        second = AppController(shard=Shard(1, 2), output='zip')
+        # assert
+        self.assertEqual(first.container.path, 'tasks.shard-0-of-2.zip')
+        self.assertNotEqual(first.report_index.path, second.report_index.path)
+        self.assertNotEqual(first.container.path, second.container.path)
+
+
+class UserFingerprintsTest(unittest.TestCase):
+    """Tests UserFingerprints class"""
+
+    def test_delta_run_rebuilds_only_changed_users(self):
+        """Checks if the second run writes only added and changed users and counts removed"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            users = [User(i, f'Name {i}', f'user{i}', 'example@gmail.com', 'Company Example',
+                          [Todo(i, i, f'task{i}', False)])
+                     for i in range(5)]
+            sut = AppController(delta=True)
+            sut.fingerprints = UserFingerprints(directory)
+            sut.writer_class = MemoryWriter
+            sut.manifest = ReportManifest(directory)
+            sut._run_sequential(sut.fingerprints.filter(users))
+            sut.fingerprints.save()
+            users[1].tasks[0] = Todo(1, 1, 'task1', True)
+            users[2].tasks.reverse()
+            users = users[1:] + [User(7, 'Name 7', 'user7', 'example@gmail.com',
+                                      'Company Example', [])]
+            sut.fingerprints = UserFingerprints(directory)
+            MemoryWriter.documents = {}
+            # act
+            sut._run_sequential(sut.fingerprints.filter(users))
+            sut.fingerprints.save()
+            # assert
+            self.assertEqual(sorted(MemoryWriter.documents), ['user1', 'user7'])
+            self.assertEqual(sut.fingerprints.counts,
+                             {'added': 1, 'changed': 1, 'unchanged': 3, 'removed': 1})
+
+    def test_delta_run_confirms_users_with_unchanged_reports(self):
+        """Checks if users whose report is skipped by the manifest are not rebuilt again"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            users = [User(i, f'Name {i}', f'user{i}', 'example@gmail.com', 'Company Example',
+                          [Todo(i, i, f'task{i}', False)])
+                     for i in range(3)]
+            sut = AppController()
+            sut.manifest = ReportManifest(directory)
+            sut.writer_options.update(report_index=None, layout=ReportLayout(directory))
+            sut._run_sequential(users)
+            sut.manifest.save()
+            counts = []
+            # act
+            for _ in range(2):
+                sut.manifest = ReportManifest(directory)
+                sut.fingerprints = UserFingerprints(directory)
+                written, _ = sut._run_sequential(sut.fingerprints.filter(users))
+                sut.fingerprints.save()
+                counts.append((written, sut.fingerprints.counts['added'],
+                               sut.fingerprints.counts['unchanged']))
+            # assert
+            self.assertEqual(counts, [(0, 3, 0), (0, 0, 3)])
+
+    def test_delta_run_confirms_batched_users_once_published(self):
+        """Checks if users of batched reports are confirmed by the flush, not by the write"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            users = [User(i, f'Name {i}', f'user{i}', 'example@gmail.com', 'Company Example',
+                          [Todo(i, i, f'task{i}', False)])
+                     for i in range(3)]
+            sut = AppController(delta=True, fsync_batch=10)
+            sut.manifest = ReportManifest(directory)
+            sut.fingerprints = UserFingerprints(directory)
+            sut.writer_options.update(report_index=None, layout=ReportLayout(directory))
+            written, _ = sut._run_sequential(sut.fingerprints.filter(users))
+            unconfirmed = dict(sut.fingerprints.fingerprints)
+            # act
+            sut.sync_batch.flush()
+            # assert
+            self.assertEqual((written, unconfirmed), (0, {}))
+            self.assertEqual(sut.sync_batch.published, 3)
+            self.assertEqual(sorted(sut.fingerprints.fingerprints), ['0', '1', '2'])
+
+    def test_delta_run_is_rejected_with_container_output(self):
+        """Checks if delta run can not replace a container with the changed users only"""
+        self.assertRaises(ValueError, AppController, delta=True, output='zip')
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, parse_args, ['--delta', '--output', 'sqlite'])
+
+
+class ReportContainerTest(unittest.TestCase):
+    """Tests ZipContainer and SQLiteContainer classes"""
+
+    def write_reports(self, sut, stream_reports=False):
+        """Writes reports of several users through the controller and reads them back"""
+        users = [User(i, f'Name {i}', f'user{i}', 'example@gmail.com', 'Company Example',
+                      [Todo(i, i, f'task{i}', i % 2 == 0)])
+                 for i in range(5)]
+        sut.stream_reports = stream_reports
+        date = datetime(2020, 9, 23, 15, 25)
+        for user in users:
+            sut._process_user(user, date=date)
+        sut.container.close()
+        expected = {user.username: DefaultUserBuilder(user, date).build() for user in users}
+        return dict(sut.container.iter_reports()), expected
+
+    def test_zip_container_keeps_every_report(self):
+        """Checks if zip container stores streamed reports and replaces the target when closed"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            path = os.path.join(directory, 'tasks.zip')
+            sut = AppController(output='zip', output_path=path)
+            # act
+            result, expected = self.write_reports(sut, stream_reports=True)
+            # assert
+            self.assertIsInstance(sut.container, ZipContainer)
+            self.assertEqual(result, expected)
+            self.assertEqual(os.listdir(directory), ['tasks.zip'])
+
+    def test_sqlite_container_inserts_reports_in_batches(self):
+        """Checks if sqlite container stores every report including the last partial batch"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            sut = AppController(output='sqlite', output_path=os.path.join(directory, 'tasks.db'))
+            sut.container.batch_size = 2
+            # act
+            result, expected = self.write_reports(sut)
+            # assert
+            self.assertIsInstance(sut.container, SQLiteContainer)
+            self.assertEqual(result, expected)
+
+    def test_zip_container_drops_a_report_whose_chunks_fail(self):
+        """Checks if a streamed report failing midway leaves no truncated member"""
+        def failing_chunks():
+            yield 'head\n'
+            raise ValueError('build failed')
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            sut = ZipContainer(os.path.join(directory, 'tasks.zip'))
+            sut.add('first', iter(['whole\n', 'report']))
+            # act
+            self.assertRaises(ValueError, sut.add, 'second', failing_chunks())
+            sut.close()
+            # assert
+            self.assertEqual(dict(sut.iter_reports()), {'first': 'whole\nreport'})
+
+    def test_sqlite_container_holds_only_the_reports_of_its_run(self):
+        """Checks if sqlite container replaces the database of the previous run when closed"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            path = os.path.join(directory, 'tasks.db')
+            previous = SQLiteContainer(path)
+            for username in ('first', 'second'):
+                previous.add(username, 'old report')
+            previous.close()
+            sut = SQLiteContainer(path)
+            # act
+            sut.add('first', iter(['new ', 'report']))
+            unfinished = dict(SQLiteContainer(path).iter_reports())
+            sut.close()
+            # assert
+            self.assertEqual(len(unfinished), 2)
+            self.assertEqual(dict(sut.iter_reports()), {'first': 'new report'})
+            self.assertEqual(os.listdir(directory), ['tasks.db'])
+
+
+class TodoStoreTest(unittest.TestCase):
+    """Tests TodoStore class"""
+
+    def test_store_views_contain_todos_of_the_user(self):
+        """Checks if views return the stored todos of a single user in order"""
+        # arrange
+        todos = [Todo(i % 3, i, f'task{i % 4}', i % 5 == 0) for i in range(30)]
+        sut = TodoStore()
+        # act
+        sut.extend(todos)
+        # assert
+        for user_id in range(3):
+            view = sut.view(user_id)
+            expected = [todo for todo in todos if todo.user_id == user_id]
+            self.assertEqual(list(view), expected)
+            self.assertEqual(list(view.iter_title_status()),
+                             [(todo.title, todo.completed) for todo in expected])
+        self.assertEqual(len(sut.view(42)), 0)
+
+    def test_builder_builds_the_same_document_from_a_view(self):
+        """Checks if builder output does not depend on the task storage"""
+        # arrange
+        todos = [Todo(1, i, f'task{i}' * i, i % 3 == 0) for i in range(1, 12)]
+        store = TodoStore()
+        store.extend(todos)
+        date = datetime(2020, 9, 23, 15, 25)
+        expected = DefaultUserBuilder(User(1, 'Name Example', 'admin', 'example@gmail.com',
+                                           'Company Example', todos), date).build()
+        user = User(1, 'Name Example', 'admin', 'example@gmail.com',
+                    'Company Example', store.view(1))
+        sut = DefaultUserBuilder(user, date)
+        # act
+        result = sut.build()
+        # assert
+        self.assertEqual(result, expected)
+
+
+class SyntheticDatasetTest(unittest.TestCase):
+    """Tests benchmark data generation"""
+
+    def test_dataset_is_deterministic_and_valid(self):
+        """Checks if generated records are stable, valid and encoded correctly"""
+        # arrange
+        sut = SyntheticDataset(users=5, todos=200, seed=3)
+        # act
+        todos = list(iter_json_array(iter_json_chunks(sut.iter_todos(), batch=7)))
+        users = list(iter_json_array(iter_json_chunks(sut.iter_users())))
+        # assert
+        self.assertEqual(todos, list(SyntheticDataset(5, 200, 3).iter_todos()))
+        self.assertEqual(list(sut.iter_todos(user_id=2)),
+                         [todo for todo in todos if todo['userId'] == 2])
+        self.assertEqual(len(TodoDeserializer().deserialize_many(todos).objects), 200)
+        self.assertEqual(len(UserDeserializer().deserialize_many(users).objects), 5)
+
+
+class LoggerTest(unittest.TestCase):
+    """Tests Logger and Metrics classes"""
+
+    def tearDown(self):
+        Logger.configure()
+        Metrics.reset()
+
+    def test_logger_filters_levels_and_buffers_json_lines(self):
+        """Checks if logger drops low levels and writes JSON lines in batches"""
+        # arrange
+        stream = io.StringIO()
+        Logger.configure(level='warn', json_lines=True, buffer_size=10, stream=stream)
+        # act
+        Logger.info('hidden')
+        Logger.warn('first', user='admin')
+        Logger.error('second')
+        buffered = stream.getvalue()
+        Logger.flush()
+        # assert
+        self.assertEqual(buffered, '')
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([(line['level'], line['message']) for line in lines],
+                         [('warn', 'first'), ('error', 'second')])
+        self.assertEqual(lines[0]['user'], 'admin')
+
+    def test_summary_groups_warnings_by_category(self):
+        """Checks if repeated warnings are printed once with a count and samples"""
+        # arrange
+        stream = io.StringIO()
+        Logger.configure(stream=stream)
+        sut = WarningSummary('join')
+        # act
+        for i in range(5):
+            sut.add('Received task without a user', f'todo {i}')
+        sut.add('Other')
+        sut.emit()
+        # assert
+        self.assertEqual(stream.getvalue().splitlines(), [
+            '\033[93m [warn]: \033[00mjoin: Received task without a user (5 times), '
+            'e.g. todo 0; todo 1; todo 2',
+            '\033[93m [warn]: \033[00mjoin: Other (1 times)',
+        ])
+
+    def test_summary_prints_every_warning_when_verbose(self):
+        """Checks if verbose mode keeps the per record stream"""
+        # arrange
+        stream = io.StringIO()
+        Logger.configure(stream=stream, verbose=True)
+        sut = WarningSummary('join')
+        # act
+        for i in range(3):
+            sut.add('Received task without a user', f'todo {i}')
+        sut.emit()
+        # assert
+        self.assertEqual(len(stream.getvalue().splitlines()), 3)
+
+    def test_metrics_time_iterations_and_count(self):
+        """Checks if metrics accumulate stage calls and counters"""
+        # act
+        items = list(Metrics.timed_iter('stage', range(3)))
+        with Metrics.timer('stage'):
+            Metrics.increment('counter', 2)
+        Metrics.increment('counter')
+        # assert
+        self.assertEqual(items, [0, 1, 2])
+        self.assertEqual(Metrics.calls['stage'], 5)
+        self.assertEqual(Metrics.counters['counter'], 3)
+
+
+class ReportArchiverTest(unittest.TestCase):
+    """Tests ReportArchiver class"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_old_report(self, username, date):
+        """Creates archived report of the user"""
+        name = f'old_{username}_{date.strftime("%Y-%m-%dT%H:%M")}.txt'
+        with open(os.path.join(self.directory.name, name), 'w', encoding='utf-8') as report:
+            report.write(f'{username} {date}')
+
+    def test_archiver_packs_old_reports_and_retrieves_them(self):
+        """Checks if old reports are moved into monthly archives and can be read back"""
+        # arrange
+        dates = [datetime(2022, 7, 30, 10, 0), datetime(2022, 8, 1, 10, 0)]
+        for date in dates:
+            self.create_old_report('user_name', date)
+        sut = ReportArchiver(self.directory.name)
+        # act
+        result = sut.rotate(now=datetime(2022, 8, 2))
+        # assert
+        self.assertEqual(result, 2)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['archive'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory.name, 'archive'))),
+                         ['2022-07.zip', '2022-08.zip', 'index.json'])
+        reader = ReportArchiver(self.directory.name)
+        self.assertEqual(reader.versions('user_name'), dates)
+        self.assertEqual(reader.retrieve('user_name', dates[1]), f'user_name {dates[1]}')
+
+    def test_archiver_updates_the_report_index_of_every_shard(self):
+        """Checks if reports packed by the first shard are moved in the other shards' indexes"""
+        # arrange
+        date = datetime(2022, 8, 1, 10, 0)
+        self.create_old_report('user_name', date)
+        old_path = os.path.join(self.directory.name, 'old_user_name_2022-08-01T10:00.txt')
+        own = ReportIndex(self.directory.name, Shard(0, 2).file_name(ReportIndex.FILE_NAME))
+        other = ReportIndex(self.directory.name, Shard(1, 2).file_name(ReportIndex.FILE_NAME))
+        other.publish('user_name', old_path, date, None, 1)
+        other.close()
+        sut = ReportArchiver(self.directory.name,
+                             report_index=ReportIndexGroup(self.directory.name, own))
+        # act
+        sut.rotate(now=datetime(2022, 8, 2))
+        sut.report_index.close()
+        # assert
+        self.assertEqual([index.path for index in sut.report_index.indexes],
+                         [own.path, other.path])
+        self.assertEqual(other.current('user_name').path,
+                         os.path.join(self.directory.name, 'archive', '2022-08.zip',
+                                      'user_name', '2022-08-01T10:00.txt'))
+        other.close()
+
+    def test_archiver_applies_retention_policy(self):
+        """Checks if archiver keeps only the last versions within the maximal age"""
+        # arrange
+        dates = [datetime(2022, 6, 1), datetime(2022, 7, 1),
+                 datetime(2022, 7, 20), datetime(2022, 8, 1)]
+        for date in dates:
+            self.create_old_report('admin', date)
+        sut = ReportArchiver(self.directory.name, keep_last=3, max_age_days=20)
+        # act
+        sut.rotate(now=datetime(2022, 8, 5))
+        # assert
+        self.assertEqual(sut.versions('admin'), dates[2:])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory.name, 'archive'))),
+                         ['2022-07.zip', '2022-08.zip', 'index.json'])
+        self.assertIsNone(sut.retrieve('admin', dates[1]))
+
+    def test_archiver_indexes_members_left_by_an_interrupted_rotation(self):
+        """Checks if packed members missing from a lost or corrupt index are found again"""
+        # arrange
+        dates = [datetime(2022, 7, 1, 10, 0), datetime(2022, 7, 2, 10, 0)]
+        self.create_old_report('admin', dates[0])
+        ReportArchiver(self.directory.name).rotate(now=datetime(2022, 8, 1))
+        index_path = os.path.join(self.directory.name, 'archive', 'index.json')
+        with open(index_path, 'w', encoding='utf-8') as index:
+            index.write('{broken')
+        # The member is packed but its source was not removed yet
+        self.create_old_report('admin', dates[1])
+        with zipfile.ZipFile(os.path.join(self.directory.name, 'archive', '2022-07.zip'),
+                             'a') as archive:
+            archive.writestr('admin/2022-07-02T10:00.txt', f'admin {dates[1]}')
+        with contextlib.redirect_stdout(io.StringIO()):
+            sut = ReportArchiver(self.directory.name)
+            # act
+            result = sut.rotate(now=datetime(2022, 8, 1))
+        # assert
+        self.assertEqual(result, 1)
+        self.assertEqual(ReportArchiver(self.directory.name).versions('admin'), dates)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['archive'])
+
+    def test_archiver_opens_only_archives_changed_since_the_index_was_saved(self):
+        """Checks if rotation does not read archives the index already knows"""
+        # arrange
+        date = datetime(2022, 7, 1, 10, 0)
+        self.create_old_report('admin', date)
+        ReportArchiver(self.directory.name).rotate(now=datetime(2022, 8, 1))
+        sut = ReportArchiver(self.directory.name)
+        # act
+        with unittest.mock.patch('zipfile.ZipFile', side_effect=AssertionError('opened')):
+            unchanged = sut.rotate(now=datetime(2022, 8, 1))
+        with zipfile.ZipFile(os.path.join(self.directory.name, 'archive', '2022-07.zip'),
+                             'a') as archive:
+            archive.writestr('admin/2022-07-02T10:00.txt', 'admin')
+        ReportArchiver(self.directory.name).rotate(now=datetime(2022, 8, 1))
+        # assert
+        self.assertEqual(unchanged, 0)
+        self.assertEqual(ReportArchiver(self.directory.name).versions('admin'),
+                         [date, datetime(2022, 7, 2, 10, 0)])
+
+
+class StageProfilerTest(unittest.TestCase):
+    """Tests StageProfiler class"""
+
+    def tearDown(self):
+        Metrics.profiler = None
+        Metrics.reset()
+
+    def test_profiler_attributes_nested_stages_of_every_thread(self):
+        """Checks if every timed stage gets its own profile without the inner stages"""
+        def build():
+            with Metrics.timer('build'):
+                return ''.join(str(number) for number in range(1000))
+
+        def join():
+            with Metrics.timer('join'):
+                return sorted(range(1000), reverse=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            sut = StageProfiler(directory)
+            sut.start()
+            Metrics.profiler = sut
+            # act
+            with Metrics.timer('fetch'):
+                join()
+            threads = [threading.Thread(target=build) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            Metrics.profiler = None
+            sut.dump()
+            # assert
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['allocations.txt', 'build.prof', 'build.txt', 'fetch.prof',
+                              'fetch.txt', 'join.prof', 'join.txt', 'memory.json'])
+            with open(os.path.join(directory, 'memory.json'), encoding='utf-8') as memory:
+                self.assertEqual({stage: values['calls']
+                                  for stage, values in json.load(memory).items()},
+                                 {'build': 3, 'fetch': 1, 'join': 1})
+            with open(os.path.join(directory, 'fetch.txt'), encoding='utf-8') as fetch:
+                self.assertNotIn('sorted', fetch.read())
+            with open(os.path.join(directory, 'join.txt'), encoding='utf-8') as join_profile:
+                self.assertIn('sorted', join_profile.read())
+
+    def test_profiler_covers_background_todo_fetching(self):
+        """Checks if todos fetched on the worker thread and deserialization get profiles"""
+        with tempfile.TemporaryDirectory() as directory:
+            # arrange
+            users_path = os.path.join(directory, 'users.ndjson')
+            todos_path = os.path.join(directory, 'todos.ndjson')
+            write_ndjson(users_path, [user_record(1)])
+            write_ndjson(todos_path, [{'userId': 1, 'id': i, 'title': f'task{i}',
+                                       'completed': False} for i in range(3)])
+            provider = NDJSONUserProvider(UserDeserializer(),
+                                          NDJSONTodoProvider(TodoDeserializer(), todos_path),
+                                          users_path)
+            profile_directory = os.path.join(directory, 'profile')
+            sut = StageProfiler(profile_directory)
+            sut.start()
+            Metrics.profiler = sut
+            # act
+            with Metrics.timer('fetch'):
+                users = provider.get_users()
+            Metrics.profiler = None
+            sut.dump()
+            # assert
+            self.assertEqual(len(users[0].tasks), 3)
+            self.assertTrue({'fetch_todos.prof', 'deserialize.prof'}
+                            <= set(os.listdir(profile_directory)))
+            self.assertEqual(Metrics.calls['fetch_todos'], 1)
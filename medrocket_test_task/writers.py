@@ -1,37 +1,319 @@
 """Writer classes"""
 
 import abc
+import enum
+import hashlib
+import json
 import os
+import shutil
+import threading
 from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from medrocket_test_task.index import ReportIndex, ReportRecord
 from medrocket_test_task.logging import Logger
+from medrocket_test_task.paths import ReportLayout
 
 from medrocket_test_task.model import User
 
 
+class WriteResult(enum.Enum):
+    """Outcome of a write, true only when the report was written"""
+    WRITTEN = 'written'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+    # Waits in a SyncBatch, which reports the publication
+    SCHEDULED = 'scheduled'
+
+    def __bool__(self) -> bool:
+        return self is WriteResult.WRITTEN
+
+
 class Writer(abc.ABC):
     """Abstract writer"""
 
     @abc.abstractmethod
-    def write(self, data: str):
-        """Writes data"""
+    def write(self, data: Union[str, Iterable[str]]) -> WriteResult:
+        """Writes data given as a string or chunks"""
+
+
+class ReportHasher:
+    """Incremental hash of a report ignoring the generation time in its second line"""
+
+    def __init__(self) -> None:
+        self.hash = hashlib.sha256()
+        self.head = ''
+        self.head_hashed = False
+
+    def update(self, chunk: str):
+        """Adds chunk of the report"""
+        if self.head_hashed:
+            self.hash.update(chunk.encode('utf-8'))
+            return
+        self.head += chunk
+        if self.head.count('\n') >= 2:
+            self._hash_head()
+
+    def hexdigest(self) -> str:
+        """Returns hash of the added chunks"""
+        if not self.head_hashed:
+            self._hash_head()
+        return self.hash.hexdigest()
+
+    def _hash_head(self):
+        lines = self.head.split('\n', 2)
+        if len(lines) > 1:
+            lines[1] = lines[1].rsplit(' ', 2)[0]
+        self.hash.update('\n'.join(lines).encode('utf-8'))
+        self.head = ''
+        self.head_hashed = True
+
+
+class ReportManifest:
+    """Stores content hashes of the written reports"""
+    FILE_NAME: str = '.manifest.json'
+
+    def __init__(self, directory: str = None, file_name: str = None) -> None:
+        if directory is None:
+            directory = FileSystemWriter.TASK_DIRECTORY
+        self.path = os.path.join(directory, file_name or self.FILE_NAME)
+        self.lock = threading.Lock()
+        self.hashes: Dict[str, str] = self._load()
+        self.skipped = 0
+
+    @staticmethod
+    def content_hash(data: str) -> str:
+        """Returns hash of the report ignoring the generation time in its second line"""
+        hasher = ReportHasher()
+        hasher.update(data)
+        return hasher.hexdigest()
+
+    def is_unchanged(self, username: str, content_hash: str) -> bool:
+        """Checks if the last written report of the user has the same hash, counts skips"""
+        with self.lock:
+            unchanged = self.hashes.get(username) == content_hash
+            if unchanged:
+                self.skipped += 1
+            return unchanged
+
+    def update(self, username: str, content_hash: str):
+        """Remembers hash of the written report"""
+        with self.lock:
+            self.hashes[username] = content_hash
+
+    def save(self):
+        """Saves manifest next to the reports"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with self.lock, open(temp_path, 'w', encoding='utf-8') as manifest:
+            json.dump(self.hashes, manifest)
+        os.replace(temp_path, self.path)
+
+    def _load(self) -> Dict[str, str]:
+        if not os.path.exists(self.path):
+            return dict()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as manifest:
+                return json.load(manifest)
+        except ValueError:
+            Logger.warn('Report manifest is corrupted, all reports will be rewritten')
+            return dict()
+
+
+class SyncBatch:
+    """
+    Publishes written reports together: temporary files are synced to disk
+    in one round, then moved in place, then their directories are synced once\n
+    on_published is called with the user of every report published
+    """
+
+    def __init__(self, size: int = 256, on_published: Callable[[User], None] = None) -> None:
+        self.size = size
+        self.on_published = on_published
+        self.published = 0
+        self.pending: List[Tuple['FileSystemWriter', str, str, str]] = []
+        self.lock = threading.Lock()
+
+    def add(self, writer: 'FileSystemWriter', temp_path: str, path: str, content_hash: str):
+        """Schedules publication of the temporary file, flushes a full batch"""
+        with self.lock:
+            self.pending.append((writer, temp_path, path, content_hash))
+            if len(self.pending) >= self.size:
+                self._flush()
+
+    def flush(self):
+        """Publishes scheduled reports"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        """Publishes every report it can, a failed one does not affect the others"""
+        pending, self.pending = self.pending, []
+        synced = []
+        for writer, temp_path, path, content_hash in pending:
+            try:
+                fsync_path(temp_path)
+            except OSError as error:
+                Logger.error(f'Failed to sync the report of {writer.user.username}: {error}')
+                writer.discard(temp_path)
+                continue
+            synced.append((writer, temp_path, path, content_hash))
+        directories = set()
+        for writer, temp_path, path, content_hash in synced:
+            try:
+                if not writer.publish(temp_path, path, content_hash):
+                    continue
+            except Exception as error:
+                Logger.error(f'Failed to publish the report of {writer.user.username}: {error}')
+                writer.discard(temp_path)
+                continue
+            directories.add(os.path.dirname(path) or '.')
+            self.published += 1
+            if self.on_published is not None:
+                self.on_published(writer.user)
+        for directory in directories:
+            try:
+                fsync_path(directory)
+            except OSError as error:
+                Logger.error(f'Failed to sync directory {directory}: {error}')
+
+
+def fsync_path(path: str):
+    """Flushes file or directory to disk"""
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
 
 
 class FileSystemWriter(Writer):
     """Writer working with the file system"""
     TASK_DIRECTORY: str = 'tasks'
+    BUFFER_SIZE: int = 1024 * 1024
 
-    def __init__(self, user: User) -> None:
+    def __init__(self, user: User, manifest: ReportManifest = None,
+                 fsync: bool = False, sync_batch: SyncBatch = None,
+                 generated_at: datetime = None, report_index: ReportIndex = None,
+                 layout: ReportLayout = None) -> None:
         self.user = user
+        self.manifest = manifest
+        self.fsync = fsync
+        self.sync_batch = sync_batch
+        self.generated_at = generated_at
+        self.report_index = report_index
+        self.layout = layout
+
+    def write(self, data: Union[str, Iterable[str]]) -> WriteResult:
+        """
+        Writes chunks to a temporary file and publishes it with an atomic replace,
+        the previous report is archived as a hard link, so a current report always exists
+        """
+        layout = self._layout()
+        file_path = layout.report_path(self.user.username)
+        content_hash = None
+        hasher = None
+        if self.manifest is not None:
+            if isinstance(data, str):
+                content_hash = self.manifest.content_hash(data)
+                if self._is_unchanged(file_path, content_hash):
+                    return WriteResult.UNCHANGED
+            else:
+                hasher = ReportHasher()
+        chunks = [data] if isinstance(data, str) else data
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_path = layout.temp_path(self.user.username)
+        try:
+            with open(temp_path, 'w', encoding='utf-8', buffering=self.BUFFER_SIZE) as document:
+                for chunk in chunks:
+                    document.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                if self.fsync and self.sync_batch is None:
+                    document.flush()
+                    os.fsync(document.fileno())
+        except OSError as error:
+            self._remove(temp_path)
+            Logger.error('Failed to create new file: ' + str(error))
+            return WriteResult.FAILED
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        if hasher is not None:
+            content_hash = hasher.hexdigest()
+            if self._is_unchanged(file_path, content_hash):
+                self._remove(temp_path)
+                return WriteResult.UNCHANGED
+
+        if self.sync_batch is not None:
+            self.sync_batch.add(self, temp_path, file_path, content_hash)
+            return WriteResult.SCHEDULED
+        if self.publish(temp_path, file_path, content_hash):
+            return WriteResult.WRITTEN
+        return WriteResult.FAILED
+
+    def publish(self, temp_path: str, file_path: str, content_hash: str = None) -> bool:
+        """Archives the current report and replaces it with the temporary file"""
+        archive_path = None
+        try:
+            if os.path.exists(file_path):
+                archive_path = self._archive(file_path)
+            size = os.stat(temp_path).st_size
+            os.replace(temp_path, file_path)
+        except OSError as error:
+            self._remove(temp_path)
+            Logger.error('Failed to create new file: ' + str(error))
+            return False
+        if content_hash is not None:
+            self.manifest.update(self.user.username, content_hash)
+        if self.report_index is not None and self.generated_at is not None:
+            self.report_index.publish(self.user.username, file_path, self.generated_at,
+                                      content_hash, size, archive_path)
+        return True
+
+    def discard(self, temp_path: str):
+        """Removes the temporary file of a report that will not be published"""
+        self._remove(temp_path)
 
-    def write(self, data: str):
-        file_path = os.path.join(
-            self.TASK_DIRECTORY, self.user.username + '.txt')
-        if os.path.exists(file_path):
-            date = self._pull_a_date(file_path)
-            new_name = self._rename_old_file(date, file_path)
-            self._create_new_file(data, file_path, new_name)
-        else:
-            self._create_new_file(data, file_path)
+    def _layout(self) -> ReportLayout:
+        if self.layout is None:
+            self.layout = ReportLayout(self.TASK_DIRECTORY)
+        return self.layout
+
+    def _is_unchanged(self, file_path: str, content_hash: str) -> bool:
+        return (os.path.exists(file_path)
+                and self.manifest.is_unchanged(self.user.username, content_hash))
+
+    def _archive(self, file_path: str) -> str:
+        """Keeps the current report under the name with its date, returns the new name"""
+        date = self._current_date(file_path)
+        archive_path = self._layout().archive_path(self.user.username, date)
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        try:
+            os.link(file_path, archive_path)
+        except OSError:
+            shutil.copy2(file_path, archive_path)
+        return archive_path
+
+    def _current_date(self, file_path: str) -> datetime:
+        """
+        Takes the date of the current report from the index,
+        reports written before the index existed are parsed
+        """
+        if self.report_index is not None:
+            record: Optional[ReportRecord] = self.report_index.current(self.user.username)
+            if record is not None and record.path == file_path:
+                return record.generated_at
+        return self._pull_a_date(file_path)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
     def _pull_a_date(self, file_path: str) -> datetime:
         with open(file_path, 'r', encoding='utf-8') as document:
@@ -46,25 +328,3 @@ class FileSystemWriter(Writer):
                             day=date[0],
                             hour=time[0],
                             minute=time[1])
-
-    def _rename_old_file(self, date: datetime, path: str) -> str:
-        new_name = f'old_{self.user.username}_{date.strftime("%Y-%m-%dT%H:%M")}.txt'
-        new_name = os.path.join(self.TASK_DIRECTORY, new_name)
-        os.rename(path, new_name)
-        return new_name
-
-    def _create_new_file(self, data: str, path: str, renamed_file: str = ''):
-        if not os.path.exists(self.TASK_DIRECTORY):
-            os.mkdir(self.TASK_DIRECTORY)
-
-        try:
-            with open(path, 'x', encoding='utf-8') as document:
-                document.write(data)
-        except OSError as error:
-            if renamed_file:
-                try:
-                    os.rename(renamed_file, path)
-                except OSError as critical_error:
-                    Logger.error(
-                        'Critical error, impossible to rename old file: ' + str(critical_error))
-            Logger.error('Failed to create new file: ' + str(error))